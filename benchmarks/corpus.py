@@ -0,0 +1,349 @@
+# Synthetic corpus for the benchmarks: .eml and .msg files of varying body
+# size, MIME nesting depth and attachment count, generated from a seed so
+# every run measures the same files.
+#
+#   python benchmarks/corpus.py <output dir> [--count N] [--seed S]
+#
+# .eml files go to <output dir>/eml and .msg files to <output dir>/msg.
+import os
+import sys
+import math
+import random
+import struct
+import argparse
+import datetime
+import email.utils
+from email import policy
+from email.message import EmailMessage
+
+# Body sizes in bytes, nesting depths and attachment counts are drawn from
+# these with the given weights.
+BODY_SIZES = ((2 * 1024, 5), (40 * 1024, 3), (400 * 1024, 1))
+DEPTHS = ((0, 2), (1, 3), (2, 3), (3, 2))
+ATTACHMENT_COUNTS = ((0, 4), (1, 3), (3, 2), (8, 1))
+# Attachment sizes are log-uniform between these.
+ATTACHMENT_MIN = 1024
+ATTACHMENT_MAX = 2 * 1024 * 1024
+
+WORDS = ("invoice meeting project report quarter budget review schedule update customer "
+         "delivery contract agenda summary release planning office request approval team").split()
+ATTACHMENT_TYPES = (("report.pdf", "application", "pdf"), ("photo.jpg", "image", "jpeg"),
+                    ("data.xlsx", "application", "vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+                    ("notes.txt", "text", "plain"), ("archive.zip", "application", "zip"))
+
+
+def weighted(rng, choices):
+    return rng.choices([value for value, _ in choices], [weight for _, weight in choices])[0]
+
+
+def sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def text_body(rng, size):
+    paragraphs = []
+    length = 0
+    while length < size:
+        paragraph = " ".join(sentence(rng) for _ in range(rng.randint(2, 6)))
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def html_body(text):
+    rows = "".join(f"<tr><td>{i}</td><td>{paragraph}</td></tr>\n"
+                   for i, paragraph in enumerate(text.split("\n\n")))
+    return f"<html><body><p>Hello,</p><table border=\"1\">\n{rows}</table></body></html>"
+
+
+def attachment_data(rng, subtype):
+    size = int(math.exp(rng.uniform(math.log(ATTACHMENT_MIN), math.log(ATTACHMENT_MAX))))
+    if subtype == "plain":
+        return text_body(rng, size).encode("utf-8")[:size]
+    # Random bytes do not compress, like most real attachments.
+    return rng.randbytes(size)
+
+
+def message_spec(rng, number):
+    # Everything a generated message consists of, independent of the format.
+    date = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc) + \
+        datetime.timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+    text = text_body(rng, weighted(rng, BODY_SIZES))
+    attachments = []
+    for position in range(weighted(rng, ATTACHMENT_COUNTS)):
+        filename, maintype, subtype = rng.choice(ATTACHMENT_TYPES)
+        name, ext = os.path.splitext(filename)
+        attachments.append((f"{name}{position}{ext}", maintype, subtype, attachment_data(rng, subtype)))
+    return {
+        "from": (f"Sender {number}", f"sender{number}@example.com"),
+        "to": [(f"Recipient {i}", f"recipient{i}@example.com") for i in range(rng.randint(1, 4))],
+        "cc": [(f"Copy {i}", f"copy{i}@example.com") for i in range(rng.randint(0, 2))],
+        "subject": f"{sentence(rng, 6)[:-1]} #{number}",
+        "date": date,
+        "message_id": f"<bench.{number}@example.com>",
+        "text": text,
+        "html": html_body(text),
+        "depth": weighted(rng, DEPTHS),
+        "attachments": attachments,
+    }
+
+
+def build_eml(spec):
+    # depth 0 is a single HTML part, 1 adds a text alternative, and each
+    # further level wraps the body in another multipart/mixed with a note.
+    message = EmailMessage()
+    if spec["depth"] == 0:
+        message.set_content(spec["html"], subtype="html")
+    else:
+        message.set_content(spec["text"])
+        message.add_alternative(spec["html"], subtype="html")
+        for level in range(spec["depth"] - 1):
+            inner = message
+            message = EmailMessage()
+            message.make_mixed()
+            message.attach(inner)
+            note = EmailMessage()
+            note.set_content(f"Nested part at level {level + 1}.")
+            message.attach(note)
+    for filename, maintype, subtype, data in spec["attachments"]:
+        message.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
+    message["From"] = email.utils.formataddr(spec["from"])
+    message["To"] = ", ".join(email.utils.formataddr(a) for a in spec["to"])
+    if spec["cc"]:
+        message["Cc"] = ", ".join(email.utils.formataddr(a) for a in spec["cc"])
+    message["Subject"] = spec["subject"]
+    message["Date"] = email.utils.format_datetime(spec["date"])
+    message["Message-ID"] = spec["message_id"]
+    return message.as_bytes(policy=policy.SMTP)
+
+
+# Minimal compound file (CFB version 3) writer, just enough for the .msg
+# files below: 512-byte sectors, a mini stream for streams under 4096 bytes
+# and DIFAT sectors for large files.
+SECTOR = 512
+MINI_SECTOR = 64
+MINI_CUTOFF = 4096
+FREE = 0xFFFFFFFF
+END_OF_CHAIN = 0xFFFFFFFE
+FAT_SECTOR = 0xFFFFFFFD
+DIFAT_SECTOR = 0xFFFFFFFC
+NO_STREAM = 0xFFFFFFFF
+
+
+def _entry_order(name):
+    # Sibling order required by the format: shorter names first, then by
+    # upper-cased name.
+    return (len(name), name.upper())
+
+
+def write_compound_file(path, tree):
+    # tree maps stream names to bytes and storage names to nested dicts.
+    entries = [["Root Entry", 5, None, b""]]     # name, type, children, data
+    def add(node):
+        children = []
+        for name, value in node.items():
+            entries.append([name, 1 if isinstance(value, dict) else 2, None, b""])
+            index = len(entries) - 1
+            if isinstance(value, dict):
+                entries[index][2] = add(value)
+            else:
+                entries[index][3] = value
+            children.append(index)
+        return sorted(children, key=lambda index: _entry_order(entries[index][0]))
+    entries[0][2] = add(tree)
+
+    # Small streams are packed into the mini stream, the rest get sectors.
+    mini_stream = bytearray()
+    mini_fat = []
+    starts = {}
+    big_streams = []
+    for index, (_, entry_type, _, data) in enumerate(entries):
+        if entry_type != 2 or not data:
+            starts[index] = END_OF_CHAIN
+        elif len(data) < MINI_CUTOFF:
+            first = len(mini_stream) // MINI_SECTOR
+            count = -(-len(data) // MINI_SECTOR)
+            mini_fat.extend(range(first + 1, first + count))
+            mini_fat.append(END_OF_CHAIN)
+            mini_stream += data + b"\0" * (count * MINI_SECTOR - len(data))
+            starts[index] = first
+        else:
+            big_streams.append(index)
+
+    sectors = []        # contents of the data sectors, in order
+    fat = []
+
+    def allocate(data):
+        if not data:
+            return END_OF_CHAIN
+        first = len(sectors)
+        count = -(-len(data) // SECTOR)
+        for i in range(count):
+            sectors.append(data[i * SECTOR:(i + 1) * SECTOR])
+        fat.extend(range(first + 1, first + count))
+        fat.append(END_OF_CHAIN)
+        return first
+
+    for index in big_streams:
+        starts[index] = allocate(entries[index][3])
+    mini_stream_start = allocate(bytes(mini_stream))
+    mini_fat_data = struct.pack(f"<{len(mini_fat)}I", *mini_fat)
+    mini_fat_data += struct.pack("<I", FREE) * (-len(mini_fat) % (SECTOR // 4))
+    mini_fat_start = allocate(mini_fat_data)
+
+    # Balanced binary trees of siblings; every node is black, which readers
+    # accept.
+    links = {index: [NO_STREAM, NO_STREAM, NO_STREAM] for index in range(len(entries))}
+    def tree_root(children):
+        if not children:
+            return NO_STREAM
+        middle = len(children) // 2
+        root = children[middle]
+        links[root][0] = tree_root(children[:middle])
+        links[root][1] = tree_root(children[middle + 1:])
+        return root
+    for index, (_, _, children, _) in enumerate(entries):
+        if children is not None:
+            links[index][2] = tree_root(children)
+
+    directory = bytearray()
+    for index, (name, entry_type, _, data) in enumerate(entries):
+        encoded = name.encode("utf-16-le")[:62]
+        if index == 0:
+            start, size = mini_stream_start, len(mini_stream)
+        else:
+            start, size = starts.get(index, END_OF_CHAIN), len(data)
+        directory += encoded + b"\0" * (64 - len(encoded))
+        directory += struct.pack("<HBB3I", len(encoded) + 2, entry_type, 1, *links[index])
+        directory += b"\0" * 36 + struct.pack("<IQ", start, size)
+    while len(directory) % SECTOR:
+        directory += b"\0" * 64 + struct.pack("<HBB3I", 0, 0, 0, NO_STREAM, NO_STREAM, NO_STREAM)
+        directory += b"\0" * 36 + struct.pack("<IQ", 0, 0)
+    directory_start = allocate(bytes(directory))
+
+    # The FAT has to describe its own sectors and the DIFAT sectors too.
+    per_sector = SECTOR // 4
+    fat_count = difat_count = 0
+    while True:
+        total = len(sectors) + fat_count + difat_count
+        needed_fat = -(-total // per_sector)
+        needed_difat = -(-max(0, needed_fat - 109) // (per_sector - 1))
+        if (needed_fat, needed_difat) == (fat_count, difat_count):
+            break
+        fat_count, difat_count = needed_fat, needed_difat
+    fat_start = len(sectors)
+    fat_sectors = list(range(fat_start, fat_start + fat_count))
+    difat_sectors = list(range(fat_start + fat_count, fat_start + fat_count + difat_count))
+    fat.extend([FAT_SECTOR] * fat_count + [DIFAT_SECTOR] * difat_count)
+    fat.extend([FREE] * (fat_count * per_sector - len(fat)))
+
+    difat = bytearray()
+    rest = fat_sectors[109:]
+    for i, sector in enumerate(difat_sectors):
+        chunk = rest[i * (per_sector - 1):(i + 1) * (per_sector - 1)]
+        chunk += [FREE] * (per_sector - 1 - len(chunk))
+        following = difat_sectors[i + 1] if i + 1 < len(difat_sectors) else END_OF_CHAIN
+        difat += struct.pack(f"<{per_sector}I", *chunk, following)
+
+    header_difat = fat_sectors[:109] + [FREE] * (109 - len(fat_sectors[:109]))
+    header = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1" + b"\0" * 16
+    header += struct.pack("<HHHHH", 0x3E, 3, 0xFFFE, 9, 6) + b"\0" * 6
+    header += struct.pack("<9I", 0, fat_count, directory_start, 0, MINI_CUTOFF,
+                          mini_fat_start if mini_fat else END_OF_CHAIN, len(mini_fat_data) // SECTOR,
+                          difat_sectors[0] if difat_sectors else END_OF_CHAIN, difat_count)
+    header += struct.pack("<109I", *header_difat)
+
+    with open(path, "wb") as out:
+        out.write(header)
+        for data in sectors:
+            out.write(data + b"\0" * (SECTOR - len(data)))
+        out.write(struct.pack(f"<{len(fat)}I", *fat))
+        out.write(difat)
+
+
+# MAPI properties written to the generated .msg files.
+PT_LONG = 0x0003
+PT_SYSTIME = 0x0040
+PT_UNICODE = 0x001F
+PT_BINARY = 0x0102
+
+
+def _properties(header_size, strings=(), binaries=(), fixed=()):
+    # A storage's __properties_version1.0 stream and __substg1.0 streams.
+    # fixed holds (prop_id, prop_type, value) for PT_LONG and PT_SYSTIME.
+    streams = {}
+    table = bytearray(header_size)
+    for prop_id, value in strings:
+        # The stream has no terminator, but the size counts one.
+        data = value.encode("utf-16-le")
+        streams[f"__substg1.0_{prop_id:04X}{PT_UNICODE:04X}"] = data
+        table += struct.pack("<HHIII", PT_UNICODE, prop_id, 6, len(data) + 2, 0)
+    for prop_id, data in binaries:
+        streams[f"__substg1.0_{prop_id:04X}{PT_BINARY:04X}"] = data
+        table += struct.pack("<HHIII", PT_BINARY, prop_id, 6, len(data), 0)
+    for prop_id, prop_type, value in fixed:
+        table += struct.pack("<HHIQ", prop_type, prop_id, 6, value)
+    streams["__properties_version1.0"] = bytes(table)
+    return streams
+
+
+def build_msg(spec, path):
+    # An Outlook-style .msg: plain text body, plus PR_HTML for messages that
+    # are not single-part, recipients and attachments by value.
+    filetime = int((spec["date"] - datetime.datetime(1601, 1, 1, tzinfo=datetime.timezone.utc)).total_seconds()
+                   * 10 ** 7)
+    recipients = [(1, r) for r in spec["to"]] + [(2, r) for r in spec["cc"]]
+    strings = [(0x001A, "IPM.Note"), (0x0037, spec["subject"]), (0x0C1A, spec["from"][0]), (0x5D01, spec["from"][1]),
+               (0x0E04, "; ".join(name for name, _ in spec["to"])),
+               (0x0E03, "; ".join(name for name, _ in spec["cc"])),
+               (0x1035, spec["message_id"]), (0x1000, spec["text"])]
+    binaries = [(0x1013, spec["html"].encode("utf-8"))] if spec["depth"] else []
+    header = struct.pack("<8xIIII8x", len(recipients), len(spec["attachments"]),
+                         len(recipients), len(spec["attachments"]))
+    tree = _properties(32, strings, binaries, [(0x0039, PT_SYSTIME, filetime), (0x3FDE, PT_LONG, 65001)])
+    tree["__properties_version1.0"] = header + tree["__properties_version1.0"][32:]
+    # Named property mapping, empty but required by the format.
+    tree["__nameid_version1.0"] = {f"__substg1.0_{stream:04X}0102": b"" for stream in (2, 3, 4)}
+    for position, (recipient_type, (name, address)) in enumerate(recipients):
+        tree[f"__recip_version1.0_#{position:08X}"] = _properties(
+            8, [(0x3001, name), (0x39FE, address)], fixed=[(0x0C15, PT_LONG, recipient_type)])
+    for position, (filename, maintype, subtype, data) in enumerate(spec["attachments"]):
+        tree[f"__attach_version1.0_#{position:08X}"] = _properties(
+            8, [(0x3707, filename), (0x370E, f"{maintype}/{subtype}")], [(0x3701, data)],
+            [(0x3705, PT_LONG, 1)])
+    write_compound_file(path, tree)
+
+
+def generate(directory, count=200, seed=1):
+    # Writes count messages in each format; returns the paths by format.
+    rng = random.Random(seed)
+    paths = {"eml": [], "msg": []}
+    for kind in paths:
+        os.makedirs(os.path.join(directory, kind), exist_ok=True)
+    for number in range(count):
+        spec = message_spec(rng, number)
+        eml_path = os.path.join(directory, "eml", f"{number:05d}.eml")
+        with open(eml_path, "wb") as out:
+            out.write(build_eml(spec))
+        paths["eml"].append(eml_path)
+        msg_path = os.path.join(directory, "msg", f"{number:05d}.msg")
+        build_msg(spec, msg_path)
+        paths["msg"].append(msg_path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic .eml/.msg corpus")
+    parser.add_argument("directory")
+    parser.add_argument("--count", type=int, default=200, help="messages per format (default 200)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    paths = generate(args.directory, args.count, args.seed)
+    size = sum(os.path.getsize(p) for kind in paths.values() for p in kind)
+    print(f"Wrote {args.count} .eml and {args.count} .msg files ({size / 1024 / 1024:.1f} MB) "
+          f"to {args.directory}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+# Benchmarks for Emlee's message handling, for .eml and .msg:
+#
+#   core  folder index and metadata scan of the whole folder, time to
+#         headers (header_reader), time to body (parse_email_file) and
+#         attachment extraction, called directly without Qt.
+#   gui   load_email_file in the viewer on the offscreen Qt platform, timed
+#         until the header pane and until the body are shown.
+#
+#   python benchmarks/run.py [--corpus DIR] [--count N] [--repeat N]
+#                            [--suite core|gui] [--output FILE]
+#
+# Without --corpus a synthetic corpus (see corpus.py) is generated in a
+# temporary directory. Each suite runs in a process of its own, so the peak
+# RSS it reports is its own. The results are written as JSON for comparing
+# runs; a summary goes to stderr.
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import datetime
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+KINDS = ("eml", "msg")
+SUITES = ("core", "gui")
+# Longest a single load in the gui suite may take before it counts as failed.
+LOAD_TIMEOUT_MS = 60 * 1000
+
+
+def summarize(samples):
+    # Statistics of a list of durations in seconds, in milliseconds.
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    def ms(value):
+        return round(value * 1000, 3)
+    return {"count": len(ordered), "min_ms": ms(ordered[0]), "median_ms": ms(statistics.median(ordered)),
+            "p95_ms": ms(ordered[round(0.95 * (len(ordered) - 1))]), "max_ms": ms(ordered[-1]),
+            "total_ms": ms(sum(ordered))}
+
+
+def peak_rss_kb(children=False):
+    # Peak resident set size of this process, or of its finished children,
+    # in KB. None where it cannot be measured.
+    try:
+        import resource
+    except ImportError:
+        return None if children else _windows_peak_rss_kb()
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and in KB elsewhere.
+    return usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+
+
+def _windows_peak_rss_kb():
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + \
+                [(name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                    "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage",
+                    "PagefileUsage", "PeakPagefileUsage")]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(
+                ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize // 1024
+    except (ImportError, AttributeError, OSError):
+        return None
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def corpus_files(corpus, kind):
+    directory = os.path.join(corpus, kind)
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.lower().endswith("." + kind))
+
+
+def run_core(corpus, kind, repeat):
+    from emlee_core import (FolderIndex, email_extensions, extract_attachments, header_reader,
+                            parse_email_file, parse_pool, read_metadata)
+    directory = os.path.join(corpus, kind)
+    paths = corpus_files(corpus, kind)
+    samples = {"folder_index": [], "metadata_scan": [], "headers": [], "body": [], "attachments": []}
+    extracted_bytes = 0
+    with tempfile.TemporaryDirectory() as scratch:
+        for _ in range(repeat):
+            samples["folder_index"].append(timed(FolderIndex, directory, email_extensions()))
+            # The way MetadataIndex scans a folder.
+            samples["metadata_scan"].append(timed(lambda: list(parse_pool.map(read_metadata, paths))))
+            for path in paths:
+                read_headers = header_reader(path)
+                samples["headers"].append(timed(read_headers, path))
+                started = time.perf_counter()
+                message = parse_email_file(path)
+                samples["body"].append(time.perf_counter() - started)
+                if message.attachments:
+                    targets = [(attachment, os.path.join(scratch, str(attachment.index)))
+                               for attachment in message.attachments]
+                    samples["attachments"].append(timed(extract_attachments, path, targets))
+                    extracted_bytes += sum(os.path.getsize(target) for _, target in targets)
+                    for _, target in targets:
+                        os.remove(target)
+    parse_pool.shutdown()
+    result = {name: summarize(values) for name, values in samples.items()}
+    result["files"] = len(paths)
+    result["attachment_bytes"] = extracted_bytes // repeat
+    result["peak_rss_kb"] = peak_rss_kb()
+    return result
+
+
+def run_gui(corpus, kind, repeat):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    # Keep the metadata index and attachment cache out of the user's cache.
+    scratch = tempfile.mkdtemp(prefix="emlee-bench-")
+    os.environ["XDG_CACHE_HOME"] = os.environ["LOCALAPPDATA"] = scratch
+    from PyQt5 import QtCore, QtWidgets
+    import main
+    from emlee_core import parse_pool
+
+    app = QtWidgets.QApplication(sys.argv[:1])
+    viewer = main.EmailViewer()
+    viewer.resize(1000, 700)
+    viewer.show()
+    # Every load should parse its file: no neighbours parsed ahead, no
+    # headers taken from the metadata index.
+    viewer.prefetcher.schedule = lambda *args: None
+    if viewer.metadata_index is not None:
+        viewer.metadata_index.stop()
+        viewer.metadata_index = None
+
+    marks = {}
+    loop = QtCore.QEventLoop()
+    show_headers, show_message = viewer.show_headers, viewer.show_message
+
+    def on_headers(headers):
+        show_headers(headers)
+        marks.setdefault("headers", time.perf_counter())
+
+    def on_message(file_path, message):
+        show_message(file_path, message)
+        marks["body"] = time.perf_counter()
+        loop.quit()
+
+    def on_failed(token, file_path, error):
+        marks["error"] = error
+        loop.quit()
+
+    viewer.show_headers = on_headers
+    viewer.show_message = on_message
+    viewer.on_load_failed = on_failed
+
+    timeout = QtCore.QTimer()
+    timeout.setSingleShot(True)
+    timeout.timeout.connect(loop.quit)
+
+    def load(path):
+        marks.clear()
+        viewer.message_cache.clear()
+        started = time.perf_counter()
+        viewer.load_email_file(path)
+        if "body" not in marks and "error" not in marks:
+            timeout.start(LOAD_TIMEOUT_MS)
+            loop.exec_()
+            timeout.stop()
+        return started
+
+    paths = corpus_files(corpus, kind)
+    # The first load also indexes the folder and starts the worker
+    # processes; it is not counted.
+    load(paths[0])
+    samples = {"headers": [], "body": []}
+    failed = 0
+    for _ in range(repeat):
+        for path in paths:
+            started = load(path)
+            if "body" not in marks:
+                failed += 1
+                continue
+            samples["headers"].append(marks.get("headers", marks["body"]) - started)
+            samples["body"].append(marks["body"] - started)
+    viewer.close()
+    # Wait for the workers so their peak RSS can be read.
+    parse_pool.executor().shutdown(wait=True)
+    app.processEvents()
+    shutil.rmtree(scratch, ignore_errors=True)
+    result = {name: summarize(values) for name, values in samples.items()}
+    result["files"] = len(paths)
+    result["failed"] = failed
+    result["peak_rss_kb"] = peak_rss_kb()
+    result["peak_rss_workers_kb"] = peak_rss_kb(children=True)
+    return result
+
+
+def run_suite(corpus, suite, kind, repeat):
+    # Runs one suite in a fresh interpreter and returns its results.
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--corpus", corpus,
+               "--suite", suite, "--kind", kind, "--repeat", str(repeat)]
+    output = subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(results, out):
+    for name, result in results.items():
+        parts = []
+        for measure in ("folder_index", "metadata_scan", "headers", "body", "attachments"):
+            stats = result.get(measure)
+            if stats:
+                parts.append(f"{measure} {stats['median_ms']:.1f} ms")
+        if result.get("peak_rss_kb"):
+            parts.append(f"peak RSS {result['peak_rss_kb'] / 1024:.0f} MB")
+        print(f"{name:9} " + ", ".join(parts), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Emlee benchmarks")
+    parser.add_argument("--corpus", help="directory made by corpus.py (default: generate one)")
+    parser.add_argument("--count", type=int, default=100, help="messages per format to generate (default 100)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the corpus (default 3)")
+    parser.add_argument("--suite", choices=SUITES, action="append", help="run only this suite")
+    parser.add_argument("--kind", choices=KINDS, action="append", help="run only this format")
+    parser.add_argument("--output", "-o", help="file to write the JSON results to instead of standard output")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    suites = args.suite or SUITES
+    kinds = args.kind or KINDS
+
+    if args.child:
+        run = run_core if suites[0] == "core" else run_gui
+        json.dump(run(args.corpus, kinds[0], args.repeat), sys.stdout)
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix="emlee-corpus-") as generated:
+        corpus = args.corpus
+        if corpus is None:
+            import corpus as corpus_module
+            corpus = generated
+            corpus_module.generate(corpus, args.count, args.seed)
+        results = {}
+        for suite in suites:
+            for kind in kinds:
+                results[f"{suite}.{kind}"] = run_suite(corpus, suite, kind, args.repeat)
+        report = {
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "corpus": {"path": args.corpus, "count": None if args.corpus else args.count,
+                       "seed": None if args.corpus else args.seed,
+                       "bytes": {kind: sum(os.path.getsize(p) for p in corpus_files(corpus, kind))
+                                 for kind in kinds}},
+            "repeat": args.repeat,
+            "results": results,
+        }
+    print_summary(results, sys.stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            json.dump(report, out, indent=2)
+            out.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
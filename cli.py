@@ -0,0 +1,193 @@
+# Emlee from the command line, without Qt, e.g. on a server:
+#
+#   python cli.py export <dir> [--format json|csv|html] [--output FILE]
+#                              [--body] [--recursive] [--jobs N]
+#
+# (or "emlee.exe export ..." with the frozen build). Files are parsed on a
+# process pool and each record is written out as soon as it is ready, with
+# only a bounded number of files in flight, so memory use does not grow
+# with the number of files exported.
+import sys
+import os
+import argparse
+import collections
+import concurrent.futures
+import csv
+import html
+import json
+from emlee_core import (
+    ARCHIVE_EXTENSIONS, HEADER_NAMES, MBOX_EXTENSIONS, email_extensions, html_to_text, is_container, is_maildir,
+    open_index, parse_email_file, read_metadata,
+)
+
+EXPORT_FIELDS = ("path",) + HEADER_NAMES + ("attachments",)
+
+# Files handed to a worker at a time, and batches kept in flight per worker.
+EXPORT_BATCH = 64
+EXPORT_WINDOW = 4
+
+
+def export_record(file_path, include_body=False):
+    # One exported record. A file that cannot be read gets an "error" entry
+    # instead of stopping the export.
+    record = {"path": file_path}
+    try:
+        if include_body:
+            message = parse_email_file(file_path)
+            headers = message.headers
+            attachments = [attachment.filename for attachment in message.attachments]
+            body = html_to_text(message.body)
+        else:
+            metadata = read_metadata(file_path)
+            headers = metadata["headers"]
+            attachments = metadata["attachments"]
+        for name in HEADER_NAMES:
+            record[name] = headers.get(name, "")
+        record["attachments"] = attachments
+        if include_body:
+            record["body"] = body
+    except Exception as e:
+        record["error"] = str(e)
+    return record
+
+
+def export_batch(paths, include_body=False):
+    return [export_record(path, include_body) for path in paths]
+
+
+def iter_email_files(directory, recursive=False):
+    # Email files under directory in the order os.scandir returns them, so a
+    # huge folder is never listed in memory as a whole. The messages of an
+    # mbox file, a Maildir or an archive are yielded as locators (see
+    # open_index).
+    if is_container(directory):
+        yield from open_index(directory).files
+        return
+    extensions = email_extensions()
+    pending = [directory]
+    while pending:
+        with os.scandir(pending.pop()) as it:
+            for entry in it:
+                try:
+                    if recursive and entry.is_dir(follow_symlinks=False):
+                        if is_maildir(entry.path):
+                            yield from open_index(entry.path).files
+                        else:
+                            pending.append(entry.path)
+                    elif entry.name.lower().endswith(extensions) and entry.is_file():
+                        yield entry.path
+                    elif entry.name.lower().endswith(MBOX_EXTENSIONS + ARCHIVE_EXTENSIONS) and entry.is_file():
+                        yield from open_index(entry.path).files
+                except OSError:
+                    pass
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_records(paths, include_body=False, jobs=None):
+    # export_record for each path, in order. Unlike Executor.map, which
+    # submits every task up front, only jobs * EXPORT_WINDOW batches are
+    # submitted at any time.
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1:
+        for path in paths:
+            yield export_record(path, include_body)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = collections.deque()
+        for batch in _batches(paths, EXPORT_BATCH):
+            pending.append(pool.submit(export_batch, batch, include_body))
+            if len(pending) >= jobs * EXPORT_WINDOW:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def write_json(records, out):
+    # A JSON array, written one record at a time.
+    out.write("[")
+    separator = "\n"
+    for record in records:
+        out.write(separator + json.dumps(record, ensure_ascii=False))
+        separator = ",\n"
+    out.write("\n]\n")
+
+
+def write_csv(records, out, fields):
+    writer = csv.DictWriter(out, fieldnames=fields + ("error",), extrasaction="ignore")
+    writer.writeheader()
+    for record in records:
+        record["attachments"] = "; ".join(record.get("attachments", ()))
+        writer.writerow(record)
+
+
+def write_html(records, out, fields):
+    out.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Emlee export</title></head>\n"
+              "<body><table border=\"1\">\n<tr>")
+    out.write("".join(f"<th>{html.escape(field)}</th>" for field in fields + ("error",)))
+    out.write("</tr>\n")
+    for record in records:
+        record["attachments"] = "; ".join(record.get("attachments", ()))
+        out.write("<tr>" + "".join(f"<td>{html.escape(str(record.get(field, '')))}</td>"
+                                   for field in fields + ("error",)) + "</tr>\n")
+    out.write("</table></body></html>\n")
+
+
+def export(args):
+    if not os.path.isdir(args.directory) and not is_container(args.directory):
+        print(f"Not a directory, mailbox or archive: {args.directory}", file=sys.stderr)
+        return 2
+    fields = EXPORT_FIELDS + (("body",) if args.body else ())
+    counts = {"files": 0, "failed": 0}
+
+    def counted(records):
+        for record in records:
+            counts["files"] += 1
+            if "error" in record:
+                counts["failed"] += 1
+            yield record
+
+    paths = iter_email_files(args.directory, args.recursive)
+    records = counted(iter_records(paths, args.body, args.jobs))
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        if args.format == "json":
+            write_json(records, out)
+        elif args.format == "csv":
+            write_csv(records, out, fields)
+        else:
+            write_html(records, out, fields)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Exported {counts['files']} files ({counts['failed']} failed)", file=sys.stderr)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="emlee", description="Emlee email file tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="export the headers of the email files in a folder or mailbox")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("--format", choices=("json", "csv", "html"), default="json")
+    export_parser.add_argument("--output", "-o", help="file to write to instead of standard output")
+    export_parser.add_argument("--body", action="store_true", help="include the body as plain text")
+    export_parser.add_argument("--recursive", "-r", action="store_true", help="include subfolders")
+    export_parser.add_argument("--jobs", "-j", type=int, help="worker processes (default: one per core)")
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        return export(args)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
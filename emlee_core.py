@@ -0,0 +1,2464 @@
+# Emlee's message handling without any Qt: reading .eml and .msg files,
+# extracting attachments, the folder and metadata indexes and the caches.
+# The viewer in main.py and the command line tool in cli.py are both built
+# on this module, and it is what the worker processes import.
+import sys
+import os
+import binascii
+import array
+import bisect
+import codecs
+import datetime
+import re
+import struct
+import hashlib
+import shutil
+import mmap
+import contextlib
+import sqlite3
+import tempfile
+import threading
+import concurrent.futures
+import multiprocessing
+import zlib
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+import html
+from html.parser import HTMLParser
+import email
+import email.utils
+from email import policy
+from email.parser import BytesParser
+
+# .msg files are read natively; extract_msg is only a fallback for files the
+# built-in reader cannot handle. Install it via pip for that fallback. It
+# pulls in a large dependency tree, so it is imported on first use rather
+# than at startup.
+_NOT_LOADED = object()
+extract_msg = _NOT_LOADED
+
+
+def load_extract_msg():
+    # The extract_msg module, or None when it is not installed.
+    global extract_msg
+    if extract_msg is _NOT_LOADED:
+        try:
+            import extract_msg as module
+        except ImportError:
+            module = None
+            print("Warning: extract_msg module not found. Unusual .msg files may not open.")
+        extract_msg = module
+    return extract_msg
+
+
+def email_extensions():
+    # File extensions that Emlee can display.
+    return (".eml", ".msg")
+
+
+def path_key(path):
+    # Normalised form of a path used for lookups, so "C:/a/b.eml" and
+    # "C:\a\b.eml" resolve to the same entry.
+    return os.path.normcase(os.path.normpath(path))
+
+
+class FolderIndex:
+    # Sorted list of the email files in one directory with O(1) position
+    # lookup. It is built once per directory and then refreshed incrementally:
+    # a refresh only rescans the directory when its mtime changed (or when a
+    # file system watcher marked it dirty) and only merges the names that were
+    # added or removed instead of re-globbing and re-sorting everything.
+    def __init__(self, directory, extensions):
+        self.directory = directory
+        self.extensions = tuple(extensions)
+        self.files = []        # Full paths in display order.
+        self._keys = []        # Sort keys parallel to self.files.
+        self._names = set()    # File names currently in the index.
+        self._positions = {}   # path_key(path) -> index into self.files.
+        self._mtime = None
+        self.key_func = None   # Optional primary sort key; see sort_by.
+        self.reverse = False
+        self.dates = {}        # path_key(path) -> read_date(path), see date_key.
+        self.dates_scanned = False
+        self.dirty = True
+        self.refresh()
+
+    # Whether the metadata and date scans should cover every message when
+    # the index is opened.
+    bulk_scan = True
+
+    def __len__(self):
+        return len(self.files)
+
+    def watch_paths(self):
+        # Directories whose changes mark the index dirty.
+        return [self.directory]
+
+    def sort_key(self, path):
+        name_key = os.path.basename(path).lower()
+        if self.key_func is None:
+            return name_key
+        return (self.key_func(path), name_key)
+
+    def sort_by(self, key_func=None, reverse=False):
+        # Reorders the folder by key_func(path), with the file name as a tie
+        # breaker, or by file name alone when key_func is None. Files added
+        # later are merged in using the same key.
+        self.key_func = key_func
+        self.reverse = reverse
+        entries = sorted(((self.sort_key(p), p) for p in self.files), reverse=reverse)
+        self._set_entries(entries)
+
+    def date_key(self, path):
+        # Chronological sort key, from the dates filled in by a background
+        # scan when available and read on demand for files it did not cover.
+        key = path_key(path)
+        timestamp = self.dates.get(key)
+        if timestamp is None:
+            timestamp = self.dates[key] = read_date(path)
+        return timestamp
+
+    def _set_entries(self, entries):
+        self._keys = [e[0] for e in entries]
+        self.files = [e[1] for e in entries]
+        self._positions = {path_key(p): i for i, p in enumerate(self.files)}
+
+    def _scan(self):
+        # Names of the email files, relative to self.directory.
+        names = set()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.lower().endswith(self.extensions):
+                    try:
+                        if entry.is_file():
+                            names.add(entry.name)
+                    except OSError:
+                        pass
+        return names
+
+    def _version(self):
+        return os.stat(self.directory).st_mtime_ns
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def refresh(self):
+        # Returns True when the contents of the index changed.
+        try:
+            mtime = self._version()
+        except OSError:
+            mtime = None
+        if not self.dirty and mtime == self._mtime:
+            return False
+        self.dirty = False
+        self._mtime = mtime
+        try:
+            names = self._scan()
+        except OSError:
+            names = set()
+
+        added = names - self._names
+        removed = self._names - names
+        if not added and not removed:
+            return False
+
+        entries = list(zip(self._keys, self.files))
+        if removed:
+            removed_paths = {self._path(name) for name in removed}
+            entries = [e for e in entries if e[1] not in removed_paths]
+        if added:
+            new_paths = [self._path(name) for name in added]
+            # The existing entries are already sorted, so sorting the
+            # concatenation is a linear merge of two runs.
+            entries.extend(sorted(((self.sort_key(p), p) for p in new_paths), reverse=self.reverse))
+            entries.sort(reverse=self.reverse)
+        self._set_entries(entries)
+        self._names = names
+        return True
+
+    def index_of(self, path):
+        return self._positions.get(path_key(path), -1)
+
+    def insertion_point(self, path):
+        # Position `path` would have in the current order, found by a binary
+        # search on the sort keys; for a file that is gone, its place among
+        # the files that are left.
+        key = self.sort_key(path)
+        low, high = 0, len(self._keys)
+        while low < high:
+            middle = (low + high) // 2
+            if (self._keys[middle] > key) if self.reverse else (self._keys[middle] < key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def neighbour(self, path, step):
+        # Path of the file `step` positions away from `path`, wrapping around
+        # at either end. If `path` is no longer in the folder, step from the
+        # place it would have in it.
+        if not self.files:
+            return None
+        index = self.index_of(path)
+        if index < 0:
+            index = self.insertion_point(path) - (1 if step > 0 else 0)
+        return self.files[(index + step) % len(self.files)]
+
+
+class MaildirIndex(FolderIndex):
+    # The messages of a Maildir folder: every file in its cur and new
+    # subdirectories, whatever the name. Mail clients rename files there
+    # when flags change, which a refresh picks up as a removal plus an
+    # addition.
+    SUBDIRECTORIES = ("cur", "new")
+
+    def __init__(self, directory):
+        super().__init__(directory, ())
+
+    def watch_paths(self):
+        return [os.path.join(self.directory, name) for name in self.SUBDIRECTORIES]
+
+    def _scan(self):
+        names = set()
+        for subdirectory in self.SUBDIRECTORIES:
+            with os.scandir(os.path.join(self.directory, subdirectory)) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        if entry.is_file():
+                            names.add(os.path.join(subdirectory, entry.name))
+                    except OSError:
+                        pass
+        return names
+
+    def _version(self):
+        return tuple(os.stat(path).st_mtime_ns for path in self.watch_paths())
+
+
+class ArchiveIndex(FolderIndex):
+    # The email files in a ZIP or tar archive, listed from its catalogue
+    # (see archive_catalogue) and addressed as <archive>::<member name>.
+    # Nothing is unpacked: a member is only read when it is shown. Members
+    # of a .tar.gz can only be reached by decompressing from a checkpoint,
+    # so those archives are not bulk scanned; their dates come with the
+    # catalogue instead.
+    def __init__(self, path):
+        self.bulk_scan = not path.lower().endswith(GZIP_ARCHIVE_EXTENSIONS)
+        super().__init__(path, email_extensions())
+
+    def watch_paths(self):
+        return []
+
+    def _scan(self):
+        catalogue = archive_catalogue(self.directory)
+        if catalogue.dates is not None:
+            fallback = os.path.getmtime(self.directory)
+            self.dates = {path_key(self._path(name)): fallback if timestamp is None else timestamp
+                          for name, timestamp in catalogue.dates.items()}
+            self.dates_scanned = True
+        return {name for name in catalogue.names()
+                if name.lower().endswith(self.extensions)}
+
+    def _version(self):
+        st = os.stat(self.directory)
+        return (st.st_size, st.st_mtime_ns)
+
+    def _path(self, name):
+        return member_locator(self.directory, name)
+
+
+class MboxIndex:
+    # The messages of an mbox file, located by the offsets of their "From "
+    # separator lines. The offsets come from one pass over the mapped file
+    # and are kept in an array, so a mailbox of several GB is indexed
+    # without splitting it or reading messages into memory, and stepping to
+    # a neighbour is just the next offset. When the file has only grown,
+    # only the appended part is scanned. Messages stay in file order, which
+    # is normally the order they arrived in; sorting only changes direction,
+    # as any other order would need the headers of every message.
+    bulk_scan = False
+
+    def __init__(self, path):
+        self.directory = path
+        self.offsets = array.array("Q")
+        self.reverse = False
+        self.dates = {}
+        # Sorting only changes direction, so no dates are needed.
+        self.dates_scanned = True
+        self.dirty = True
+        self._stat = None
+        self.files = _MboxLocators(self)
+        self.refresh()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def watch_paths(self):
+        return []
+
+    def locator(self, position):
+        if self.reverse:
+            position = len(self.offsets) - 1 - position
+        return member_locator(self.directory, self.offsets[position])
+
+    def _current_stat(self):
+        try:
+            st = os.stat(self.directory)
+            return (st.st_size, st.st_mtime_ns)
+        except OSError:
+            return None
+
+    def stale(self):
+        # Whether a refresh would rescan the file. Only takes a stat.
+        return self.dirty or self._current_stat() != self._stat
+
+    def rescan(self):
+        # The (stat, offsets) a refresh switches to. The index itself is only
+        # read, so this can run on a worker thread while the GUI thread keeps
+        # using the index, and the result be applied there with update.
+        stat = self._current_stat()
+        offsets = array.array("Q")
+        if stat is not None:
+            with open_mapped(self.directory) as buf:
+                last = self.offsets[-1] if self.offsets else None
+                if self._stat is not None and last is not None and stat[0] > self._stat[0] and \
+                        buf[last:last + 5] == b"From ":
+                    # Appended to: only look past the last known message.
+                    offsets = self.offsets[:-1]
+                    offsets.extend(scan_mbox(buf, last))
+                else:
+                    offsets = scan_mbox(buf)
+        return stat, offsets
+
+    def update(self, scan):
+        # Applies the result of rescan; returns True when the messages
+        # changed.
+        self.dirty = False
+        self._stat, offsets = scan
+        changed = offsets != self.offsets
+        self.offsets = offsets
+        return changed
+
+    def refresh(self):
+        # Returns True when the messages changed.
+        if not self.stale():
+            return False
+        return self.update(self.rescan())
+
+    def index_of(self, path):
+        container, member = split_locator(path)
+        if member is None or path_key(container) != path_key(self.directory) or not member.isdigit():
+            return -1
+        offset = int(member)
+        position = bisect.bisect_left(self.offsets, offset)
+        if position == len(self.offsets) or self.offsets[position] != offset:
+            return -1
+        return len(self.offsets) - 1 - position if self.reverse else position
+
+    def insertion_point(self, path):
+        member = split_locator(path)[1]
+        position = bisect.bisect_left(self.offsets, int(member) if member and member.isdigit() else 0)
+        return len(self.offsets) - position if self.reverse else position
+
+    # Stepping works exactly as in a folder.
+    neighbour = FolderIndex.neighbour
+
+    def sort_by(self, key_func=None, reverse=False):
+        self.reverse = reverse
+
+    def date_key(self, path):
+        return read_date(path)
+
+
+class _MboxLocators:
+    # The locators of an MboxIndex as a read-only sequence, made on demand so
+    # a huge mailbox does not need a string per message in memory.
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self.index)
+        if not 0 <= position < len(self.index):
+            raise IndexError(position)
+        return self.index.locator(position)
+
+
+def is_maildir(path):
+    return os.path.isdir(os.path.join(path, "cur")) and os.path.isdir(os.path.join(path, "new"))
+
+
+def is_mbox_file(path):
+    # mbox files are recognised by extension or, for files without one such
+    # as Thunderbird's, by starting with a "From " line.
+    if split_locator(path)[1] is not None or not os.path.isfile(path):
+        return False
+    ext = os.path.splitext(path)[1].lower()
+    if ext in MBOX_EXTENSIONS:
+        return True
+    if ext:
+        return False
+    try:
+        with open(path, 'rb') as f:
+            return f.read(5) == b"From "
+    except OSError:
+        return False
+
+
+def is_archive(path):
+    return split_locator(path)[1] is None and is_archive_name(path) and os.path.isfile(path)
+
+
+def is_container(path):
+    # A path that holds many messages: an mbox file, a Maildir folder or an
+    # archive.
+    return is_mbox_file(path) or is_archive(path) or (os.path.isdir(path) and is_maildir(path))
+
+
+def message_kind(file_path):
+    # ".eml" or ".msg", whichever parser reads the message, or None when
+    # file_path is not a message Emlee can read. mbox members and the files
+    # of a Maildir are RFC 822 messages just like .eml files.
+    container, member = split_locator(file_path)
+    if member is not None:
+        if not is_archive_name(container):
+            return ".eml"
+        file_path = member
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext in (".eml", ".msg"):
+        return ext
+    directory = os.path.dirname(file_path)
+    if os.path.basename(directory) in MaildirIndex.SUBDIRECTORIES and is_maildir(os.path.dirname(directory)):
+        return ".eml"
+    return None
+
+
+def message_source(file_path):
+    # Path of whatever the message belongs to for navigation: its mbox, its
+    # Maildir, or the folder it is in.
+    container, member = split_locator(file_path)
+    if member is not None:
+        return container
+    directory = os.path.dirname(file_path)
+    if os.path.basename(directory) in MaildirIndex.SUBDIRECTORIES and is_maildir(os.path.dirname(directory)):
+        return os.path.dirname(directory)
+    return directory
+
+
+def open_index(source):
+    # The index for a message_source path.
+    if os.path.isdir(source):
+        if is_maildir(source):
+            return MaildirIndex(source)
+        return FolderIndex(source, email_extensions())
+    if is_archive_name(source):
+        return ArchiveIndex(source)
+    return MboxIndex(source)
+
+
+# The parse_* functions below do not touch any widgets, so they can run on
+# worker threads or in worker processes. Each returns a ParsedMessage.
+
+HEADER_NAMES = ("From", "To", "Cc", "Bcc", "Subject", "Date", "Message-ID")
+
+
+class Attachment:
+    # Describes one attachment: its name, its size if known, its MIME type and
+    # the index extract_attachment uses to find the payload again.
+    __slots__ = ("filename", "size", "content_type", "index")
+
+    def __init__(self, filename, size, content_type, index):
+        self.filename = filename
+        self.size = size
+        # Only a handful of distinct types occur, so share the strings.
+        self.content_type = sys.intern(content_type)
+        self.index = index
+
+
+class ParsedMessage:
+    # What the viewer needs of a parsed message: the display headers (stored
+    # as a tuple in HEADER_NAMES order), the body HTML ready for the body view
+    # and the attachments. Slots and tuples keep each record small, so the
+    # caches can hold many of them. `resources` pairs each Content-ID the
+    # body can refer to as a cid: URL with where read_inline finds that part
+    # to decode it later.
+    __slots__ = ("header_values", "body", "attachments", "resources")
+
+    def __init__(self, headers, body, attachments, resources=()):
+        self.header_values = tuple(headers.get(name, "") for name in HEADER_NAMES)
+        self.body = body
+        self.attachments = tuple(attachments)
+        self.resources = tuple(resources)
+
+    @property
+    def headers(self):
+        return dict(zip(HEADER_NAMES, self.header_values))
+
+
+def _display_headers(msg):
+    return {name: str(msg.get(name, '')) for name in HEADER_NAMES}
+
+
+# The header block is assumed to end within this many bytes; anything past it
+# is left to the full parse.
+HEADER_BLOCK_LIMIT = 1024 * 1024
+
+
+@contextlib.contextmanager
+def open_mapped(file_path):
+    # Maps a file read-only. Parsing works on slices of the mapping, so only
+    # the parts that are actually needed get copied into Python objects, and
+    # the pages are shared with the OS file cache across repeated views.
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files cannot be mapped.
+            yield b""
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+
+# A message inside a container file is addressed by a locator,
+# "<container path>::<member>", wherever a file path is used otherwise. For
+# an mbox the member is the offset of the message's "From " line, for an
+# archive the member's name.
+LOCATOR_SEPARATOR = "::"
+MBOX_EXTENSIONS = (".mbox", ".mbx")
+GZIP_ARCHIVE_EXTENSIONS = (".tar.gz", ".tgz")
+ARCHIVE_EXTENSIONS = (".zip", ".tar") + GZIP_ARCHIVE_EXTENSIONS
+
+
+def split_locator(locator):
+    # (container path, member) for a locator, (path, None) for a file path.
+    container, separator, member = locator.rpartition(LOCATOR_SEPARATOR)
+    if not separator:
+        return locator, None
+    return container, member
+
+
+def member_locator(container, member):
+    return f"{container}{LOCATOR_SEPARATOR}{member}"
+
+
+def is_archive_name(path):
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+@contextlib.contextmanager
+def open_message(file_path):
+    # Yields (buf, start, end), where buf[start:end] is the message: the
+    # mapped file, or for a compressed archive member its decompressed bytes.
+    container, member = split_locator(file_path)
+    if member is not None and is_archive_name(container):
+        with archive_catalogue(container).open(member) as view:
+            yield view
+        return
+    with open_mapped(container) as buf:
+        if member is None:
+            yield buf, 0, len(buf)
+        else:
+            start, end = mbox_message_span(buf, int(member))
+            yield buf, start, end
+
+
+@contextlib.contextmanager
+def open_whole_message(file_path):
+    # Like open_message, but the buffer holds just the message, as the .msg
+    # reader expects the compound file to start at offset 0.
+    with open_message(file_path) as (buf, start, end):
+        yield buf if start == 0 and end == len(buf) else buf[start:end]
+
+
+def scan_mbox(buf, start=0):
+    # Offsets of the "From " separator lines at or after start.
+    offsets = array.array("Q")
+    if buf[start:start + 5] == b"From ":
+        offsets.append(start)
+    position = buf.find(b"\nFrom ", start)
+    while position >= 0:
+        offsets.append(position + 1)
+        position = buf.find(b"\nFrom ", position + 6)
+    return offsets
+
+
+def mbox_message_span(buf, offset):
+    # (start, end) of the mbox message whose "From " line is at offset: it
+    # starts on the next line and runs up to the next separator line.
+    if buf[offset:offset + 5] != b"From ":
+        raise ValueError(f"No mbox message at offset {offset}")
+    start = buf.find(b"\n", offset)
+    start = len(buf) if start < 0 else start + 1
+    end = buf.find(b"\nFrom ", start - 1)
+    return start, len(buf) if end < 0 else end
+
+
+def stored_size(file_path):
+    # Size of the message in bytes, uncompressed for an archive member.
+    container, member = split_locator(file_path)
+    if member is None:
+        return os.path.getsize(file_path)
+    if is_archive_name(container):
+        return archive_catalogue(container).size(member)
+    with open_message(file_path) as (buf, start, end):
+        return end - start
+
+
+# Catalogues of the most recently used archives, per process.
+ARCHIVE_CATALOGUES = 8
+_catalogues = OrderedDict()
+_catalogues_lock = threading.Lock()
+
+
+def archive_catalogue(path):
+    # The ZipCatalogue or TarCatalogue of an archive, reused while the
+    # archive is unchanged.
+    key = path_key(path)
+    signature = file_signature(path)
+    with _catalogues_lock:
+        cached = _catalogues.get(key)
+        if cached is not None and cached[0] == signature:
+            _catalogues.move_to_end(key)
+            return cached[1]
+    catalogue = ZipCatalogue(path) if path.lower().endswith(".zip") else TarCatalogue(path)
+    with _catalogues_lock:
+        _catalogues[key] = (signature, catalogue)
+        while len(_catalogues) > ARCHIVE_CATALOGUES:
+            _catalogues.popitem(last=False)
+    return catalogue
+
+
+def has_archive_catalogue(path):
+    # Whether archive_catalogue(path) would return without reading the
+    # archive.
+    with _catalogues_lock:
+        cached = _catalogues.get(path_key(path))
+    return cached is not None and cached[0] == file_signature(path)
+
+
+def _archive_member(catalogue, name):
+    try:
+        return catalogue.members[name]
+    except KeyError:
+        raise FileNotFoundError(f"{name} not found in {catalogue.path}") from None
+
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+
+class ZipCatalogue:
+    # The members of a ZIP archive, from its central directory. Stored
+    # members are read straight from the mapped archive and deflated ones
+    # are inflated on their own; zipfile is only used for other methods.
+    def __init__(self, path):
+        import zipfile
+        self.path = path
+        # name -> (offset of the local header, method, compressed size, size)
+        self.members = {}
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                # Encrypted members cannot be read.
+                if not info.is_dir() and not info.flag_bits & 0x1:
+                    self.members[info.filename] = (info.header_offset, info.compress_type,
+                                                   info.compress_size, info.file_size)
+        # Members are cheap to reach, so their dates are read as needed.
+        self.dates = None
+
+    def names(self):
+        return self.members.keys()
+
+    def size(self, name):
+        return _archive_member(self, name)[3]
+
+    @contextlib.contextmanager
+    def open(self, name):
+        offset, method, compressed_size, size = _archive_member(self, name)
+        with open_mapped(self.path) as buf:
+            if buf[offset:offset + 4] != b"PK\x03\x04":
+                raise ValueError(f"No ZIP member at offset {offset}")
+            name_length, extra_length = struct.unpack_from("<HH", buf, offset + 26)
+            start = offset + 30 + name_length + extra_length
+            if method == ZIP_STORED:
+                yield buf, start, start + size
+                return
+            if method == ZIP_DEFLATED:
+                data = zlib.decompress(buf[start:start + compressed_size], -15)
+            else:
+                import zipfile
+                with zipfile.ZipFile(self.path) as archive:
+                    data = archive.read(name)
+            yield data, 0, len(data)
+
+
+class TarCatalogue:
+    # The members of a tar archive, plain or gzip compressed. tar has no
+    # central directory, so the catalogue takes one pass through the
+    # archive's headers. In a plain tar that pass seeks from header to header
+    # over the mapping, and members are then read straight from it. For a compressed one the pass also keeps GzipStream
+    # checkpoints, and a member is read by resuming from the nearest one
+    # rather than decompressing everything before it. As every member goes
+    # through the pass anyway, it also records their dates, so sorting by
+    # date does not decompress each member a second time.
+    def __init__(self, path):
+        import tarfile
+        self.path = path
+        self.members = {}   # name -> (offset of the data in the tar stream, size)
+        self.checkpoints = None
+        self.dates = None   # name -> Date header timestamp or None, compressed only
+        with open_mapped(path) as buf:
+            if buf[:2] == b"\x1f\x8b":
+                stream, mode = GzipStream(buf, checkpoints=[]), "r|"
+                self.checkpoints = stream.checkpoints
+                self.dates = {}
+            else:
+                # The mapping has read, seek and tell, so tarfile can skip
+                # the member data instead of reading through it.
+                stream, mode = buf, "r:"
+            with tarfile.open(fileobj=stream, mode=mode) as archive:
+                for info in archive:
+                    if info.isreg():
+                        self.members[info.name] = (info.offset_data, info.size)
+                        kind = os.path.splitext(info.name)[1].lower()
+                        if self.dates is not None and kind in (".eml", ".msg"):
+                            # An .eml only needs its header block.
+                            size = info.size if kind == ".msg" else min(info.size, HEADER_BLOCK_LIMIT)
+                            self.dates[info.name] = message_date(kind, archive.extractfile(info).read(size))
+                    # tarfile collects every TarInfo; only the offsets are
+                    # needed.
+                    archive.members.clear()
+        self._positions = [checkpoint[0] for checkpoint in self.checkpoints or ()]
+
+    def names(self):
+        return self.members.keys()
+
+    def size(self, name):
+        return _archive_member(self, name)[1]
+
+    @contextlib.contextmanager
+    def open(self, name):
+        offset, size = _archive_member(self, name)
+        with open_mapped(self.path) as buf:
+            if self.checkpoints is None:
+                yield buf, offset, offset + size
+                return
+            checkpoint = self.checkpoints[bisect.bisect_right(self._positions, offset) - 1]
+            stream = GzipStream(buf, *checkpoint)
+            stream.skip(offset - checkpoint[0])
+            data = stream.read(size)
+            yield data, 0, len(data)
+
+
+# Output between the checkpoints of a GzipStream. Each one keeps a copy of
+# the zlib state, about 40 KB.
+GZIP_CHECKPOINT_INTERVAL = 8 * 1024 * 1024
+GZIP_READ_SIZE = 64 * 1024
+
+
+class GzipStream:
+    # Reads the decompressed contents of mapped gzip data front to back,
+    # starting at `output` bytes into the contents, which the given zlib
+    # decompressor reached after `input` bytes of buf. When given a
+    # checkpoints list, it collects such (output, input, decompressor)
+    # triples every GZIP_CHECKPOINT_INTERVAL bytes to resume from later.
+    def __init__(self, buf, output=0, input=0, decompressor=None, checkpoints=None):
+        self.buf = buf
+        self.output = output
+        self.input = input
+        self.decompressor = decompressor.copy() if decompressor else zlib.decompressobj(31)
+        self.pending = bytearray()
+        self.checkpoints = checkpoints
+        if checkpoints is not None:
+            checkpoints.append((output, input, self.decompressor.copy()))
+            self.next_checkpoint = output + GZIP_CHECKPOINT_INTERVAL
+
+    def _decompress(self):
+        # Adds the next piece of output to self.pending; False at the end.
+        decompressor = self.decompressor
+        if decompressor.eof:
+            # gzip files may hold several members back to back.
+            if self.buf[self.input:self.input + 2] != b"\x1f\x8b":
+                return False
+            decompressor = self.decompressor = zlib.decompressobj(31)
+        chunk = self.buf[self.input:self.input + GZIP_READ_SIZE]
+        data = decompressor.decompress(chunk, GZIP_READ_SIZE)
+        # At the end of a member what follows it is in unused_data, and may
+        # be in unconsumed_tail as well.
+        if decompressor.eof:
+            self.input += len(chunk) - len(decompressor.unused_data)
+        else:
+            self.input += len(chunk) - len(decompressor.unconsumed_tail)
+        if not data and not decompressor.eof and self.input >= len(self.buf):
+            return False
+        self.output += len(data)
+        self.pending += data
+        if self.checkpoints is not None and self.output >= self.next_checkpoint:
+            self.checkpoints.append((self.output, self.input, decompressor.copy()))
+            self.next_checkpoint = self.output + GZIP_CHECKPOINT_INTERVAL
+        return True
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.pending) < size) and self._decompress():
+            pass
+        if size < 0:
+            size = len(self.pending)
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+    def skip(self, size):
+        while size > 0:
+            data = self.read(min(size, GZIP_READ_SIZE))
+            if not data:
+                break
+            size -= len(data)
+
+
+def find_header_end(buf, start=0, end=None):
+    # Offset just past the blank line ending the header block that starts at
+    # `start`, or `end` if there is no blank line before it.
+    if end is None:
+        end = len(buf)
+    if buf[start:start + 1] == b"\n":
+        return start + 1
+    if buf[start:start + 2] == b"\r\n":
+        return start + 2
+    ends = [end]
+    for separator in (b"\n\n", b"\r\n\r\n"):
+        position = buf.find(separator, start, end)
+        if position >= 0:
+            ends.append(position + len(separator))
+    return min(ends)
+
+
+def _parse_headers(buf, start, end):
+    return BytesParser(policy=policy.default).parsebytes(bytes(buf[start:end]), headersonly=True)
+
+
+class MimePart:
+    # Location of one MIME part inside a mapped message: the part spans
+    # buf[start:end] and its (still encoded) body starts at body_start.
+    # `headers` is a headers-only EmailMessage for the part.
+    def __init__(self, start, body_start, end, headers):
+        self.start = start
+        self.body_start = body_start
+        self.end = end
+        self.headers = headers
+
+    def is_multipart(self):
+        return self.headers.get_content_maintype() in ("multipart", "message")
+
+    def content(self, buf):
+        # Decoded content of a single part, using the email package on just
+        # this part's bytes.
+        msg = BytesParser(policy=policy.default).parsebytes(bytes(buf[self.start:self.end]))
+        return msg.get_content()
+
+
+def scan_mime(buf, start=0, end=None, default_type="text/plain"):
+    # Lists the MIME parts of the message in buf[start:end] in the same
+    # depth-first order as EmailMessage.walk(), locating boundaries in the
+    # buffer instead of parsing every body into memory. default_type is the
+    # content type of a part without one, as set by its parent.
+    if end is None:
+        end = len(buf)
+    body_start = find_header_end(buf, start, end)
+    headers = _parse_headers(buf, start, body_start)
+    headers.set_default_type(default_type)
+    parts = [MimePart(start, body_start, end, headers)]
+    content_type = headers.get_content_type()
+    if content_type == "message/delivery-status":
+        # Blocks of headers separated by blank lines, each of them a part
+        # without a body, as the email package reads it.
+        position = body_start
+        while True:
+            block_end = find_header_end(buf, position, end)
+            parts.append(MimePart(position, block_end, block_end, _parse_headers(buf, position, block_end)))
+            if block_end >= end:
+                break
+            position = block_end
+    elif headers.get_content_maintype() == "message":
+        parts.extend(scan_mime(buf, body_start, end))
+    elif headers.get_content_maintype() == "multipart":
+        boundary = headers.get_boundary()
+        if boundary:
+            # The parts of a digest are messages unless they say otherwise.
+            child_type = "message/rfc822" if content_type == "multipart/digest" else "text/plain"
+            for child_start, child_end in _split_multipart(buf, body_start, end, boundary):
+                parts.extend(scan_mime(buf, child_start, child_end, child_type))
+    return parts
+
+
+def _split_multipart(buf, start, end, boundary):
+    # (start, end) offsets of the body parts between the boundary delimiter
+    # lines of a multipart body. A missing close delimiter ends the last
+    # part at `end`, as the email package does.
+    delimiter = b"--" + boundary.encode("ascii", "surrogateescape")
+    lines = []  # (delimiter offset, offset after its line, is close delimiter)
+    position = start
+    while True:
+        found = buf.find(delimiter, position, end)
+        if found < 0:
+            break
+        line_end = buf.find(b"\n", found, end)
+        line_end = end if line_end < 0 else line_end + 1
+        rest = bytes(buf[found + len(delimiter):line_end])
+        # Only whitespace may follow, so "--abc--x" is not the close
+        # delimiter of boundary "abc" (but may be a delimiter of "abc--x").
+        is_close = rest[:2] == b"--" and not rest[2:].strip()
+        at_line_start = found == start or buf[found - 1:found] == b"\n"
+        if at_line_start and (is_close or not rest.strip()):
+            lines.append((found, line_end, is_close))
+            if is_close:
+                break
+        position = line_end
+    spans = []
+    for i, (_, part_start, is_close) in enumerate(lines):
+        if is_close:
+            break
+        part_end = lines[i + 1][0] if i + 1 < len(lines) else end
+        # Delimiter lines straight after each other have no part between
+        # them.
+        if part_end == part_start:
+            continue
+        # The line break before a delimiter belongs to the delimiter.
+        if part_end > part_start and buf[part_end - 1:part_end] == b"\n":
+            part_end -= 1
+            if part_end > part_start and buf[part_end - 1:part_end] == b"\r":
+                part_end -= 1
+        spans.append((part_start, part_end))
+    return spans
+
+
+def read_eml_headers(file_path):
+    # Fast path for the header pane: parses only the header block instead of
+    # the whole MIME tree.
+    with open_message(file_path) as (buf, start, end):
+        header_end = find_header_end(buf, start, min(end, start + HEADER_BLOCK_LIMIT))
+        msg = _parse_headers(buf, start, header_end)
+    return _display_headers(msg)
+
+
+def parse_eml(file_path):
+    with open_message(file_path) as (buf, start, end):
+        parts = scan_mime(buf, start, end)
+        root = parts[0]
+        headers = _display_headers(root.headers)
+
+        # Extract the email body while preserving formatting. Only the text
+        # parts are handed to the email package; attachments stay in the
+        # mapping.
+        body = ""
+        html_body = None
+        plain_body = None
+        if root.is_multipart():
+            for part in parts:
+                if part.headers.get_content_disposition() is None:
+                    if part.headers.get_content_type() == "text/html":
+                        html_body = part.content(buf)
+                    elif part.headers.get_content_type() == "text/plain":
+                        plain_body = part.content(buf)
+            if html_body:
+                body = html_body
+            elif plain_body:
+                body = "<pre>" + html.escape(plain_body) + "</pre>"
+        else:
+            content_type = root.headers.get_content_type()
+            content = root.content(buf)
+            if content_type == "text/html":
+                body = content
+            else:
+                body = "<pre>" + html.escape(content) + "</pre>"
+
+        attachments = _eml_attachments(buf, parts)
+        resources = _eml_resources(parts)
+
+    return ParsedMessage(headers, body, attachments, resources)
+
+
+def _eml_attachments(buf, parts):
+    # Only describe the attachments here; their payloads are decoded when one
+    # is opened or saved (see extract_attachment).
+    attachments = []
+    for index, part in enumerate(parts):
+        content_disp = part.headers.get("Content-Disposition", "")
+        if "attachment" in content_disp:
+            filename = part.headers.get_filename()
+            if filename:
+                attachments.append(Attachment(filename, _declared_part_size(buf, part),
+                                              part.headers.get_content_type(), index))
+    return attachments
+
+
+def _eml_resources(parts):
+    # Images that can be referenced from the HTML body by Content-ID, found
+    # again by the offsets of their encoded payload, so showing an image does
+    # not need another MIME scan.
+    resources = []
+    for part in parts:
+        content_id = part.headers.get("Content-ID")
+        if content_id and part.headers.get_content_maintype() == "image":
+            cte = part.headers.get("Content-Transfer-Encoding", "")
+            resources.append((_content_id(content_id), (part.body_start, part.end, cte)))
+    return resources
+
+
+def _content_id(value):
+    return str(value).strip().strip("<>")
+
+
+def _declared_part_size(buf, part):
+    # Size of a part's decoded payload without decoding it: the
+    # Content-Disposition size parameter if present, otherwise an estimate
+    # from the length of the encoded payload.
+    size = part.headers.get_param("size", header="Content-Disposition")
+    if size and str(size).isdigit():
+        return int(size)
+    length = part.end - part.body_start
+    cte = part.headers.get("Content-Transfer-Encoding", "").strip().lower()
+    if cte == "base64" and length:
+        # Discount line breaks using the length of the first line.
+        newline = buf.find(b"\n", part.body_start, part.end)
+        if newline > part.body_start:
+            line = newline + 1 - part.body_start
+            line_break = 2 if buf[newline - 1:newline] == b"\r" else 1
+            length = length * (line - line_break) // line
+        return length * 3 // 4
+    return length
+
+
+def _extract_msg_source(file_path):
+    # extract_msg opens a path, or a file's contents given as bytes.
+    if split_locator(file_path)[1] is None:
+        return file_path
+    with open_whole_message(file_path) as buf:
+        return bytes(buf)
+
+
+def parse_msg_extract(file_path):
+    # extract_msg based parse, used when the native reader below cannot make
+    # sense of a file.
+    msg = load_extract_msg().Message(_extract_msg_source(file_path))
+    try:
+        headers = {
+            "From": msg.sender or "",
+            "To": msg.to or "",
+            "Cc": msg.cc or "",
+            "Bcc": msg.bcc or "",
+            "Subject": msg.subject or "",
+            "Date": msg.date or "",
+            "Message-ID": getattr(msg, "messageId", None) or "",
+        }
+        headers = {name: str(value) for name, value in headers.items()}
+
+        # For the body, prefer HTML if available.
+        if msg.htmlBody:
+            body = msg.htmlBody.decode("utf-8", errors="replace") if isinstance(msg.htmlBody, bytes) else msg.htmlBody
+        elif msg.body:
+            text = msg.body.decode("utf-8", errors="replace") if isinstance(msg.body, bytes) else msg.body
+            body = "<pre>" + html.escape(text) + "</pre>"
+        else:
+            body = ""
+
+        attachments = []
+        for index, att in enumerate(msg.attachments):
+            filename = att.longFilename if att.longFilename else att.shortFilename
+            if filename:
+                attachments.append(Attachment(filename, _msg_attachment_size(att),
+                                              getattr(att, "mimetype", None) or "application/octet-stream",
+                                              index))
+    finally:
+        msg.close()
+
+    return ParsedMessage(headers, body, attachments)
+
+
+def _msg_attachment_size(att):
+    # PR_ATTACH_SIZE, when this version of extract_msg exposes properties.
+    # It includes some property overhead, so it is only an approximation.
+    try:
+        size = att.getPropertyVal("0E200003")
+    except Exception:
+        return None
+    return size if isinstance(size, int) else None
+
+
+# Size of the slices of encoded payload decoded at a time when writing an
+# attachment to disk, which bounds the extra memory a decode needs.
+DECODE_CHUNK = 1024 * 1024
+
+
+def _encoded_chunks(buf, start, end, chunk_size, whole_lines=False):
+    # Splits buf[start:end] into bytes slices of about chunk_size, cut just
+    # after a line break where possible. With whole_lines a slice is always
+    # extended to the end of its last line, for encodings whose escapes must
+    # not be cut in half.
+    while start < end:
+        stop = min(start + chunk_size, end)
+        if stop < end:
+            newline = buf.rfind(b"\n", start, stop)
+            if newline >= start:
+                stop = newline + 1
+            elif whole_lines:
+                newline = buf.find(b"\n", stop, end)
+                stop = end if newline < 0 else newline + 1
+        yield bytes(buf[start:stop])
+        start = stop
+
+
+def iter_decoded(buf, cte, start=0, end=None, chunk_size=DECODE_CHUNK):
+    # Decodes the base64, quoted-printable or unencoded payload in
+    # buf[start:end] (bytes or a mapping) slice by slice, yielding decoded
+    # bytes, so the decoded attachment never has to exist in memory as a
+    # whole.
+    if end is None:
+        end = len(buf)
+    cte = (cte or "").strip().lower()
+    if cte == "base64":
+        leftover = b""
+        for chunk in _encoded_chunks(buf, start, end, chunk_size):
+            data = leftover + chunk.translate(None, b" \t\r\n")
+            usable = len(data) - len(data) % 4
+            leftover = data[usable:]
+            if usable:
+                yield binascii.a2b_base64(data[:usable])
+        if leftover.rstrip(b"="):
+            # Truncated input; decode what can be decoded, like get_payload.
+            yield binascii.a2b_base64(leftover + b"=" * (-len(leftover) % 4))
+    elif cte == "quoted-printable":
+        for chunk in _encoded_chunks(buf, start, end, chunk_size, whole_lines=True):
+            yield binascii.a2b_qp(chunk)
+    else:
+        yield from _encoded_chunks(buf, start, end, chunk_size)
+
+
+def decode_to_file(buf, cte, dest_path, start=0, end=None, chunk_size=DECODE_CHUNK):
+    # Streams the decoded payload into dest_path. A partially written file is
+    # removed if decoding fails.
+    try:
+        with open(dest_path, 'wb') as f:
+            for data in iter_decoded(buf, cte, start, end, chunk_size):
+                f.write(data)
+    except Exception:
+        try:
+            os.remove(dest_path)
+        except OSError:
+            pass
+        raise
+    return dest_path
+
+
+def extract_attachments(file_path, targets):
+    # Writes attachments described by parse_eml/parse_msg to disk. targets is
+    # a list of (attachment, dest_path) pairs; the source file is parsed once
+    # for all of them.
+    ext = message_kind(file_path)
+    wanted = {attachment.index: (attachment, dest_path) for attachment, dest_path in targets}
+    written = []
+    if ext == ".eml":
+        with open_message(file_path) as (buf, start, end):
+            parts = scan_mime(buf, start, end)
+            for index, (attachment, dest_path) in list(wanted.items()):
+                if index >= len(parts):
+                    continue
+                part = parts[index]
+                cte = part.headers.get("Content-Transfer-Encoding", "")
+                if cte.strip().lower() in _STREAMED_ENCODINGS:
+                    decode_to_file(buf, cte, dest_path, part.body_start, part.end)
+                else:
+                    # Rare encodings such as uuencode: let the email package
+                    # decode the payload in one go.
+                    msg = BytesParser(policy=policy.default).parsebytes(bytes(buf[part.start:part.end]))
+                    with open(dest_path, 'wb') as out:
+                        out.write(msg.get_payload(decode=True) or b"")
+                written.append(wanted.pop(index)[1])
+    elif ext == ".msg":
+        try:
+            written.extend(_extract_msg_attachments(file_path, wanted))
+        except (ValueError, IndexError, struct.error):
+            if load_extract_msg() is None:
+                raise
+        if wanted and load_extract_msg():
+            msg = extract_msg.Message(_extract_msg_source(file_path))
+            try:
+                for index, (attachment, dest_path) in list(wanted.items()):
+                    data = msg.attachments[index].data
+                    if isinstance(data, bytes):
+                        with open(dest_path, 'wb') as out:
+                            out.write(data)
+                        written.append(wanted.pop(index)[1])
+            finally:
+                msg.close()
+    if wanted:
+        missing = ", ".join(attachment.filename for attachment, _ in wanted.values())
+        raise ValueError(f"Attachment {missing} not found in {file_path}")
+    return written
+
+
+_STREAMED_ENCODINGS = ("base64", "quoted-printable", "7bit", "8bit", "binary", "")
+
+
+def extract_attachment(file_path, attachment, dest_path):
+    return extract_attachments(file_path, [(attachment, dest_path)])[0]
+
+
+def safe_filename(filename):
+    # Attachment names come from the message, so strip any directory parts
+    # and characters Windows does not allow before using one as a file name.
+    name = os.path.basename(filename.replace("\\", "/"))
+    name = "".join("_" if c in '<>:"/\\|?*' or ord(c) < 32 else c for c in name)
+    name = name.strip(" .")
+    return name or "attachment"
+
+
+def unique_filenames(names):
+    # The names, with " (2)", " (3)", ... added before the extension of any
+    # that was already used, so files saved side by side do not overwrite
+    # each other. Compared without case, as on Windows and macOS.
+    used = set()
+    unique = []
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        candidate, number = name, 1
+        while candidate.lower() in used:
+            number += 1
+            candidate = f"{stem} ({number}){ext}"
+        used.add(candidate.lower())
+        unique.append(candidate)
+    return unique
+
+
+# Upper bound on the disk space used by extracted attachments.
+ATTACHMENT_CACHE_BYTES = 512 * 1024 * 1024
+
+
+class AttachmentCache:
+    # Extracted attachments live in their own directory under the temp
+    # directory, one subdirectory per (message version, part index), so the
+    # same attachment is only written once, equally named attachments of
+    # different messages do not overwrite each other, and the original file
+    # name is kept for the application that opens it. Entries are touched on
+    # use and the least recently used ones are deleted once the total size
+    # passes max_bytes.
+    def __init__(self, root=None, max_bytes=ATTACHMENT_CACHE_BYTES):
+        self.root = root or os.path.join(tempfile.gettempdir(), "emlee-attachments")
+        self.max_bytes = max_bytes
+
+    def entry_dir(self, file_path, attachment):
+        signature = file_signature(file_path)
+        key = f"{signature}|{attachment.index}".encode("utf-8", "surrogateescape")
+        return os.path.join(self.root, hashlib.sha1(key).hexdigest())
+
+    def get(self, file_path, attachment):
+        # Path of the extracted attachment, extracting it on first use.
+        directory = self.entry_dir(file_path, attachment)
+        path = os.path.join(directory, safe_filename(attachment.filename))
+        if os.path.isfile(path):
+            os.utime(directory)
+            return path
+        os.makedirs(directory, exist_ok=True)
+        # Extract under a temporary name so a failed or interrupted extraction
+        # is never mistaken for a cached one.
+        partial_path = path + ".part"
+        extract_attachment(file_path, attachment, partial_path)
+        os.replace(partial_path, path)
+        self.trim(keep=directory)
+        return path
+
+    def trim(self, keep=None):
+        try:
+            entries = []
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        entries.append((entry.stat().st_mtime, entry.path, _dir_size(entry.path)))
+        except OSError:
+            return
+        total = sum(size for _, _, size in entries)
+        for _, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if keep is not None and path_key(path) == path_key(keep):
+                continue
+            # Files still open in another application cannot be removed on
+            # Windows; they are retried on the next trim.
+            shutil.rmtree(path, ignore_errors=True)
+            if not os.path.exists(path):
+                total -= size
+
+
+def _dir_size(path):
+    size = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_file():
+                size += entry.stat().st_size
+    return size
+
+
+def format_size(size):
+    if size is None:
+        return "unknown size"
+    for unit in ("bytes", "KB", "MB"):
+        if size < 1024 or unit == "MB":
+            return f"{size} {unit}" if unit == "bytes" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+# --- Native .msg reading ---
+# A .msg file is a Compound File Binary (OLE2) container holding MAPI
+# properties as streams. The reader below maps the file, reads the sector
+# allocation tables and the directory, and then only reads the streams it is
+# asked for, so showing a message does not touch the attachment streams at
+# all. extract_msg stays as a fallback for files this reader cannot handle.
+
+class CompoundFile:
+    SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+    END_OF_CHAIN = 0xFFFFFFFE
+    NO_STREAM = 0xFFFFFFFF
+
+    def __init__(self, buf):
+        if bytes(buf[:8]) != self.SIGNATURE:
+            raise ValueError("Not a compound file")
+        self.buf = buf
+        sector_shift, mini_shift = struct.unpack_from("<HH", buf, 0x1E)
+        self.sector_size = 1 << sector_shift
+        self.mini_sector_size = 1 << mini_shift
+        (num_fat, first_dir, _, self.mini_cutoff, first_mini_fat, _,
+         first_difat, num_difat) = struct.unpack_from("<8I", buf, 0x2C)
+
+        # The DIFAT lists the sectors holding the FAT: 109 entries in the
+        # header, the rest in a chain of DIFAT sectors.
+        fat_sectors = list(struct.unpack_from("<109I", buf, 0x4C))
+        per_sector = self.sector_size // 4 - 1
+        sector = first_difat
+        for _ in range(num_difat):
+            if sector >= self.END_OF_CHAIN:
+                break
+            entries = struct.unpack_from(f"<{per_sector + 1}I", buf, self._offset(sector))
+            fat_sectors.extend(entries[:per_sector])
+            sector = entries[per_sector]
+        self.fat = self._table(fat_sectors[:num_fat])
+        self.mini_fat = self._table(self.chain(first_mini_fat))
+
+        directory = b"".join(self._sector(s) for s in self.chain(first_dir))
+        self.entries = [self._entry(directory, offset) for offset in range(0, len(directory) - 127, 128)]
+        self._mini_stream_sectors = None
+
+    def _offset(self, sector):
+        return (sector + 1) * self.sector_size
+
+    def _sector(self, sector):
+        offset = self._offset(sector)
+        return bytes(self.buf[offset:offset + self.sector_size])
+
+    def _table(self, sectors):
+        table = array.array("I")
+        for sector in sectors:
+            if sector < self.END_OF_CHAIN:
+                table.frombytes(self._sector(sector))
+        if sys.byteorder == "big":
+            table.byteswap()
+        return table
+
+    def chain(self, start, table=None):
+        table = self.fat if table is None else table
+        sectors = []
+        sector = start
+        while sector < len(table) and len(sectors) <= len(table):
+            sectors.append(sector)
+            sector = table[sector]
+        return sectors
+
+    def _entry(self, directory, offset):
+        name_length = struct.unpack_from("<H", directory, offset + 0x40)[0]
+        name = directory[offset:offset + max(0, name_length - 2)].decode("utf-16-le", "replace")
+        entry_type = directory[offset + 0x42]
+        left, right, child = struct.unpack_from("<3I", directory, offset + 0x44)
+        start, size = struct.unpack_from("<IQ", directory, offset + 0x74)
+        if self.sector_size == 512:
+            # Version 3 files only use the low 32 bits of the size.
+            size &= 0xFFFFFFFF
+        return (name, entry_type, left, right, child, start, size)
+
+    def children(self, storage=0):
+        # Names (upper-cased) of the entries directly inside a storage,
+        # mapped to their entry numbers. Entry 0 is the root storage.
+        result = {}
+        pending = [self.entries[storage][4]]
+        while pending:
+            index = pending.pop()
+            if index >= len(self.entries) or index in result.values():
+                continue
+            name, _, left, right, _, _, _ = self.entries[index]
+            result[name.upper()] = index
+            pending.extend((left, right))
+        return result
+
+    def stream_size(self, index):
+        return self.entries[index][6]
+
+    def iter_stream(self, index, chunk_size=DECODE_CHUNK):
+        # Yields the contents of a stream in pieces of about chunk_size,
+        # reading runs of consecutive sectors in one slice.
+        _, _, _, _, _, start, size = self.entries[index]
+        if size < self.mini_cutoff:
+            yield self._read_mini(start, size)
+            return
+        remaining = size
+        run_start = run_length = None
+        for sector in self.chain(start):
+            if run_start is not None and sector == run_start + run_length and \
+                    run_length * self.sector_size < chunk_size:
+                run_length += 1
+                continue
+            if run_start is not None:
+                data = self._read_run(run_start, run_length, remaining)
+                remaining -= len(data)
+                yield data
+            run_start, run_length = sector, 1
+        if run_start is not None and remaining > 0:
+            yield self._read_run(run_start, run_length, remaining)
+
+    def _read_run(self, sector, count, limit):
+        offset = self._offset(sector)
+        return bytes(self.buf[offset:offset + min(count * self.sector_size, limit)])
+
+    def _read_mini(self, start, size):
+        # Small streams live in 64-byte sectors inside the mini stream, which
+        # itself is the root entry's stream.
+        if self._mini_stream_sectors is None:
+            self._mini_stream_sectors = self.chain(self.entries[0][5])
+        pieces = []
+        for mini_sector in self.chain(start, self.mini_fat):
+            position = mini_sector * self.mini_sector_size
+            sector = self._mini_stream_sectors[position // self.sector_size]
+            offset = self._offset(sector) + position % self.sector_size
+            pieces.append(self.buf[offset:offset + self.mini_sector_size])
+        return b"".join(pieces)[:size]
+
+    def read_stream(self, index):
+        return b"".join(self.iter_stream(index))
+
+
+# MAPI property ids used for display.
+PR_SUBJECT = 0x0037
+PR_CLIENT_SUBMIT_TIME = 0x0039
+PR_TRANSPORT_MESSAGE_HEADERS = 0x007D
+PR_SENDER_NAME = 0x0C1A
+PR_SENDER_EMAIL_ADDRESS = 0x0C1F
+PR_RECIPIENT_TYPE = 0x0C15
+PR_DISPLAY_BCC = 0x0E02
+PR_DISPLAY_CC = 0x0E03
+PR_DISPLAY_TO = 0x0E04
+PR_MESSAGE_DELIVERY_TIME = 0x0E06
+PR_BODY = 0x1000
+PR_RTF_COMPRESSED = 0x1009
+PR_HTML = 0x1013
+PR_INTERNET_MESSAGE_ID = 0x1035
+PR_DISPLAY_NAME = 0x3001
+PR_EMAIL_ADDRESS = 0x3003
+PR_ATTACH_DATA = 0x3701
+PR_ATTACH_FILENAME = 0x3704
+PR_ATTACH_LONG_FILENAME = 0x3707
+PR_ATTACH_MIME_TAG = 0x370E
+PR_ATTACH_CONTENT_ID = 0x3712
+PR_SMTP_ADDRESS = 0x39FE
+PR_INTERNET_CPID = 0x3FDE
+PR_MESSAGE_CODEPAGE = 0x3FFD
+PR_SENDER_SMTP_ADDRESS = 0x5D01
+
+PT_LONG = 0x0003
+PT_BOOLEAN = 0x000B
+PT_STRING8 = 0x001E
+PT_UNICODE = 0x001F
+PT_SYSTIME = 0x0040
+PT_BINARY = 0x0102
+
+
+def _codec(codepage, default="cp1252"):
+    if codepage == 65001:
+        return "utf-8"
+    name = f"cp{codepage}" if codepage else default
+    try:
+        codecs.lookup(name)
+    except LookupError:
+        return default
+    return name
+
+
+def _filetime(value):
+    # FILETIME (100 ns units since 1601) to an aware datetime.
+    return datetime.datetime(1601, 1, 1, tzinfo=datetime.timezone.utc) + \
+        datetime.timedelta(microseconds=value // 10)
+
+
+class MsgStorage:
+    # The MAPI properties of one storage of a .msg file: the message itself,
+    # a recipient or an attachment.
+    def __init__(self, cf, storage, header_size, codepage=None):
+        self.cf = cf
+        self.streams = cf.children(storage)
+        self.codepage = codepage
+        self.fixed = {}
+        index = self.streams.get("__PROPERTIES_VERSION1.0")
+        if index is not None:
+            data = cf.read_stream(index)
+            for offset in range(header_size, len(data) - 15, 16):
+                prop_type, prop_id = struct.unpack_from("<HH", data, offset)
+                if prop_type in (PT_LONG, PT_BOOLEAN):
+                    self.fixed[prop_id] = struct.unpack_from("<i", data, offset + 8)[0]
+                elif prop_type == PT_SYSTIME:
+                    self.fixed[prop_id] = struct.unpack_from("<Q", data, offset + 8)[0]
+        if self.codepage is None:
+            self.codepage = self.fixed.get(PR_MESSAGE_CODEPAGE) or self.fixed.get(PR_INTERNET_CPID)
+
+    def stream_index(self, prop_id, prop_type):
+        return self.streams.get(f"__SUBSTG1.0_{prop_id:04X}{prop_type:04X}")
+
+    def string(self, prop_id):
+        index = self.stream_index(prop_id, PT_UNICODE)
+        if index is not None:
+            return self.cf.read_stream(index).decode("utf-16-le", "replace").rstrip("\x00")
+        index = self.stream_index(prop_id, PT_STRING8)
+        if index is not None:
+            return self.cf.read_stream(index).decode(_codec(self.codepage), "replace").rstrip("\x00")
+        return None
+
+    def binary(self, prop_id):
+        index = self.stream_index(prop_id, PT_BINARY)
+        return None if index is None else self.cf.read_stream(index)
+
+    def substorages(self, prefix):
+        # Entry numbers of the child storages named prefix#NNNNNNNN, in order.
+        return [index for name, index in sorted(self.streams.items()) if name.startswith(prefix)]
+
+
+def _msg_address(name, address):
+    if address and name and name != address:
+        return email.utils.formataddr((name, address))
+    return address or name or ""
+
+
+def _msg_display_headers(message):
+    # Display headers the way extract_msg builds them: from the transport
+    # headers when the message kept them, otherwise from the properties.
+    headers = {}
+    transport = message.string(PR_TRANSPORT_MESSAGE_HEADERS)
+    if transport:
+        parsed = BytesParser(policy=policy.default).parsebytes(
+            transport.encode("utf-8", "surrogateescape"), headersonly=True)
+        for name in HEADER_NAMES:
+            value = parsed.get(name)
+            if value:
+                headers[name] = str(value)
+
+    if "From" not in headers:
+        headers["From"] = _msg_address(message.string(PR_SENDER_NAME),
+                                       message.string(PR_SENDER_SMTP_ADDRESS) or
+                                       message.string(PR_SENDER_EMAIL_ADDRESS))
+    recipients = {1: [], 2: [], 3: []}
+    for storage in message.substorages("__RECIP_VERSION1.0_#"):
+        recipient = MsgStorage(message.cf, storage, 8, message.codepage)
+        address = _msg_address(recipient.string(PR_DISPLAY_NAME),
+                               recipient.string(PR_SMTP_ADDRESS) or recipient.string(PR_EMAIL_ADDRESS))
+        recipients.setdefault(recipient.fixed.get(PR_RECIPIENT_TYPE, 1), []).append(address)
+    for name, recipient_type, display_prop in (("To", 1, PR_DISPLAY_TO), ("Cc", 2, PR_DISPLAY_CC),
+                                               ("Bcc", 3, PR_DISPLAY_BCC)):
+        if name not in headers:
+            headers[name] = "; ".join(recipients[recipient_type]) or message.string(display_prop) or ""
+    if "Subject" not in headers:
+        headers["Subject"] = message.string(PR_SUBJECT) or ""
+    if "Date" not in headers:
+        filetime = message.fixed.get(PR_CLIENT_SUBMIT_TIME) or message.fixed.get(PR_MESSAGE_DELIVERY_TIME)
+        headers["Date"] = email.utils.format_datetime(_filetime(filetime)) if filetime else ""
+    if "Message-ID" not in headers:
+        headers["Message-ID"] = message.string(PR_INTERNET_MESSAGE_ID) or ""
+    return headers
+
+
+def _msg_body(message):
+    # Prefer HTML: PR_HTML, else HTML encapsulated in the compressed RTF body,
+    # else the plain text body.
+    index = message.stream_index(PR_HTML, PT_BINARY)
+    if index is not None:
+        codepage = message.fixed.get(PR_INTERNET_CPID) or message.codepage
+        return message.cf.read_stream(index).decode(_codec(codepage, "utf-8"), "replace")
+    html_body = message.string(PR_HTML)
+    if html_body:
+        return html_body
+    rtf = message.binary(PR_RTF_COMPRESSED)
+    if rtf:
+        html_body = rtf_to_html(lzfu_decompress(rtf))
+        if html_body:
+            return html_body
+    text = message.string(PR_BODY)
+    if text:
+        return "<pre>" + html.escape(text) + "</pre>"
+    return ""
+
+
+def _msg_attachments(message):
+    # Attachments stored by value. Embedded messages and OLE objects have no
+    # data stream and are not listed.
+    attachments = []
+    for position, storage in enumerate(message.substorages("__ATTACH_VERSION1.0_#")):
+        attachment = MsgStorage(message.cf, storage, 8, message.codepage)
+        data_index = attachment.stream_index(PR_ATTACH_DATA, PT_BINARY)
+        if data_index is None:
+            continue
+        filename = attachment.string(PR_ATTACH_LONG_FILENAME) or \
+            attachment.string(PR_ATTACH_FILENAME) or attachment.string(PR_DISPLAY_NAME)
+        if filename:
+            attachments.append(Attachment(filename, message.cf.stream_size(data_index),
+                                          attachment.string(PR_ATTACH_MIME_TAG) or guess_type(filename),
+                                          position))
+    return attachments
+
+
+def _msg_resources(message):
+    # Attachments with a Content-ID, located by their attachment index.
+    resources = []
+    for position, storage in enumerate(message.substorages("__ATTACH_VERSION1.0_#")):
+        attachment = MsgStorage(message.cf, storage, 8, message.codepage)
+        content_id = attachment.string(PR_ATTACH_CONTENT_ID)
+        if content_id and attachment.stream_index(PR_ATTACH_DATA, PT_BINARY) is not None:
+            resources.append((_content_id(content_id), position))
+    return resources
+
+
+def read_inline(file_path, where):
+    # Decoded bytes of a part listed in ParsedMessage.resources.
+    if isinstance(where, int):
+        with open_whole_message(file_path) as buf:
+            message = MsgStorage(CompoundFile(buf), 0, 32)
+            storage = message.substorages("__ATTACH_VERSION1.0_#")[where]
+            return message.cf.read_stream(
+                MsgStorage(message.cf, storage, 8).stream_index(PR_ATTACH_DATA, PT_BINARY))
+    start, end, cte = where
+    with open_message(file_path) as (buf, _, _):
+        return b"".join(iter_decoded(buf, cte, start, end))
+
+
+def guess_type(filename):
+    # mimetypes reads the system type tables when imported, so only do that
+    # when an attachment without a declared type needs it.
+    import mimetypes
+    return mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+
+def read_msg_headers(file_path):
+    # Fast path for the header pane: only the directory and the small header
+    # property streams are read.
+    with open_whole_message(file_path) as buf:
+        return _msg_display_headers(MsgStorage(CompoundFile(buf), 0, 32))
+
+
+def parse_msg(file_path):
+    try:
+        with open_whole_message(file_path) as buf:
+            message = MsgStorage(CompoundFile(buf), 0, 32)
+            return ParsedMessage(_msg_display_headers(message), _msg_body(message),
+                                 _msg_attachments(message), _msg_resources(message))
+    except (ValueError, IndexError, struct.error):
+        if load_extract_msg() is None:
+            raise
+        return parse_msg_extract(file_path)
+
+
+def _extract_msg_attachments(file_path, wanted):
+    # Streams the wanted attachments (index -> (attachment, dest_path)) out
+    # of the compound file; returns the paths written.
+    written = []
+    with open_whole_message(file_path) as buf:
+        message = MsgStorage(CompoundFile(buf), 0, 32)
+        storages = message.substorages("__ATTACH_VERSION1.0_#")
+        for index, (attachment, dest_path) in list(wanted.items()):
+            if index >= len(storages):
+                continue
+            data_index = MsgStorage(message.cf, storages[index], 8).stream_index(PR_ATTACH_DATA, PT_BINARY)
+            if data_index is None:
+                continue
+            with open(dest_path, 'wb') as out:
+                for data in message.cf.iter_stream(data_index):
+                    out.write(data)
+            written.append(wanted.pop(index)[1])
+    return written
+
+
+# Initial dictionary contents for compressed RTF (MS-OXRTFCP).
+_LZFU_PREBUF = (b"{\\rtf1\\ansi\\mac\\deff0\\deftab720{\\fonttbl;}{\\f0\\fnil \\froman \\fswiss "
+                b"\\fmodern \\fscript \\fdecor MS Sans SerifSymbolArialTimes New RomanCourier"
+                b"{\\colortbl\\red0\\green0\\blue0\r\n\\par \\pard\\plain\\f0\\fs20\\b\\i\\u\\tab\\tx")
+
+
+def lzfu_decompress(data):
+    # Decompresses PR_RTF_COMPRESSED.
+    if len(data) < 16:
+        return b""
+    compressed_size, raw_size, compression = struct.unpack_from("<II4s", data, 0)
+    if compression == b"MELA":
+        return bytes(data[16:16 + raw_size])
+    if compression != b"LZFu":
+        return b""
+    dictionary = bytearray(4096)
+    dictionary[:len(_LZFU_PREBUF)] = _LZFU_PREBUF
+    write = len(_LZFU_PREBUF)
+    out = bytearray()
+    position = 16
+    end = min(len(data), compressed_size + 4)
+    while position < end:
+        control = data[position]
+        position += 1
+        for bit in range(8):
+            if position >= end:
+                break
+            if control & (1 << bit):
+                if position + 1 >= end:
+                    position = end
+                    break
+                word = (data[position] << 8) | data[position + 1]
+                position += 2
+                offset = word >> 4
+                if offset == write:
+                    return bytes(out)
+                for i in range((word & 0xF) + 2):
+                    byte = dictionary[(offset + i) % 4096]
+                    out.append(byte)
+                    dictionary[write] = byte
+                    write = (write + 1) % 4096
+            else:
+                byte = data[position]
+                position += 1
+                out.append(byte)
+                dictionary[write] = byte
+                write = (write + 1) % 4096
+    return bytes(out)
+
+
+_RTF_TOKEN = re.compile(
+    rb"\\([a-zA-Z]+)(-?\d+)? ?|\\'([0-9a-fA-F]{2})|\\([^a-zA-Z'])|([{}])|[\r\n]+|([^\\{}\r\n]+)")
+
+# Destinations whose text is never part of the encapsulated HTML.
+_RTF_SKIP_DESTINATIONS = {
+    b"fonttbl", b"colortbl", b"stylesheet", b"info", b"pict", b"object", b"header",
+    b"footer", b"listtable", b"listoverridetable", b"rsidtbl", b"generator",
+    b"xmlnstbl", b"themedata", b"colorschememapping", b"latentstyles", b"datastore",
+}
+
+
+def rtf_to_html(rtf):
+    # Recovers the HTML that Outlook encapsulated in an RTF body (MS-OXRTFEX):
+    # the original markup is kept in \*\htmltag groups, the text between tags
+    # is ordinary RTF text, and anything inside \htmlrtf ... \htmlrtf0 was
+    # added for RTF readers only. Returns None for RTF not made from HTML.
+    if b"\\fromhtml" not in rtf[:1024]:
+        return None
+    codec = "cp1252"
+    match = re.search(rb"\\ansicpg(\d+)", rtf[:1024])
+    if match:
+        codec = _codec(int(match.group(1)))
+
+    pieces = []
+    pending = bytearray()    # \'hh bytes waiting to be decoded together
+
+    def emit_bytes(data):
+        pending.extend(data)
+
+    def emit_text(text):
+        if pending:
+            pieces.append(pending.decode(codec, "replace"))
+            pending.clear()
+        pieces.append(text)
+
+    # Group state: (skip, in_htmltag, suppressed, unicode skip count)
+    state = [False, False, False, 1]
+    stack = []
+    skip_chars = 0
+    group_start = False
+    for match in _RTF_TOKEN.finditer(rtf):
+        word, param, hex_byte, symbol, brace, text = match.groups()
+        if brace == b"{":
+            stack.append(list(state))
+            group_start = True
+            continue
+        if brace == b"}":
+            if stack:
+                state = stack.pop()
+            group_start = False
+            continue
+        at_group_start, group_start = group_start, False
+        skip, in_htmltag, suppressed, uc = state
+        if symbol == b"*":
+            # Ignorable destination; htmltag is the one that matters here.
+            if at_group_start:
+                group_start = True
+                state[0] = "*"
+            continue
+        if word is not None:
+            if skip == "*":
+                state[0] = skip = word != b"htmltag"
+                if word == b"htmltag":
+                    state[1] = True
+                continue
+            if at_group_start and word in _RTF_SKIP_DESTINATIONS:
+                state[0] = True
+                continue
+            if skip:
+                continue
+            if word == b"htmlrtf":
+                state[2] = param != b"0"
+            elif word == b"uc":
+                state[3] = int(param or 1)
+            elif word == b"u" and (in_htmltag or not suppressed):
+                code = int(param or 0)
+                emit_text(chr(code + 65536 if code < 0 else code))
+                skip_chars = uc
+            elif word in (b"par", b"line") and (in_htmltag or not suppressed):
+                emit_text("\n")
+            elif word == b"tab" and (in_htmltag or not suppressed):
+                emit_text("\t")
+            continue
+        if skip or (suppressed and not in_htmltag):
+            continue
+        if hex_byte is not None:
+            if skip_chars:
+                skip_chars -= 1
+            else:
+                emit_bytes(bytes([int(hex_byte, 16)]))
+        elif symbol is not None:
+            if skip_chars:
+                skip_chars -= 1
+            elif symbol in (b"\\", b"{", b"}"):
+                emit_bytes(symbol)
+            elif symbol == b"~":
+                emit_text("\u00a0")
+        elif text is not None:
+            if skip_chars:
+                drop = min(skip_chars, len(text))
+                text = text[drop:]
+                skip_chars -= drop
+            emit_bytes(text)
+    emit_text("")
+    return "".join(pieces)
+
+
+def header_reader(file_path):
+    # Function giving the display headers of file_path ahead of the full
+    # parse, or None when there is no cheaper way than parsing everything.
+    ext = message_kind(file_path)
+    if ext == ".eml":
+        return read_eml_headers
+    if ext == ".msg":
+        return read_msg_headers
+    return None
+
+
+def parse_email_file(file_path):
+    ext = message_kind(file_path)
+    if ext == ".eml":
+        return parse_eml(file_path)
+    if ext == ".msg":
+        return parse_msg(file_path)
+    raise ValueError(f"Unsupported file format: {file_path}")
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style", "head"):
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style", "head") and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.chunks.append(data)
+
+
+def html_to_text(body):
+    # Plain text of a prepared body, for the search index.
+    extractor = _TextExtractor()
+    try:
+        extractor.feed(body)
+        extractor.close()
+    except Exception:
+        pass
+    return " ".join(" ".join(extractor.chunks).split())
+
+
+def read_metadata(file_path):
+    # What the metadata index stores about a file: the headers, the
+    # attachment names and the message's own size. For .eml this only needs the MIME structure, not the
+    # decoded body.
+    ext = message_kind(file_path)
+    if ext == ".eml":
+        with open_message(file_path) as (buf, start, end):
+            parts = scan_mime(buf, start, end)
+            headers = _display_headers(parts[0].headers)
+            attachments = _eml_attachments(buf, parts)
+    elif ext == ".msg":
+        with open_whole_message(file_path) as buf:
+            message = MsgStorage(CompoundFile(buf), 0, 32)
+            headers = _msg_display_headers(message)
+            attachments = _msg_attachments(message)
+    else:
+        message = parse_email_file(file_path)
+        headers = message.headers
+        attachments = message.attachments
+    return {"headers": headers, "size": stored_size(file_path),
+            "attachments": [attachment.filename for attachment in attachments]}
+
+
+def date_timestamp(value):
+    # Seconds since the epoch for a Date header, or None if it cannot be
+    # parsed.
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def message_date(kind, data):
+    # The Date header timestamp of a message of the given kind held in
+    # memory, or None. For an .eml, data may be just the header block.
+    try:
+        if kind == ".msg":
+            value = _msg_display_headers(MsgStorage(CompoundFile(data), 0, 32))["Date"]
+        else:
+            value = _parse_headers(data, 0, find_header_end(data))["Date"]
+    except Exception:
+        return None
+    return date_timestamp(value)
+
+
+def read_date(file_path):
+    # Sort key for chronological order: the Date header as a timestamp, read
+    # with the headers-only fast path, or the file's mtime when there is no
+    # usable Date header. Top level so it can run in a process pool.
+    timestamp = None
+    try:
+        read_headers = header_reader(file_path)
+        if read_headers is not None:
+            timestamp = date_timestamp(read_headers(file_path)["Date"])
+        if timestamp is None:
+            timestamp = os.path.getmtime(split_locator(file_path)[0])
+    except Exception:
+        timestamp = 0.0
+    return timestamp
+
+
+# Below this many files, dates are read in the calling thread; handing them
+# to the parse pool would cost more than it saves.
+PARALLEL_DATE_SCAN = 500
+
+
+def scan_dates(paths):
+    # read_date for many files. For large folders every file, whatever its
+    # format, is read by the parse pool's workers in chunks, apart from the
+    # members of a compressed tar (see is_offloaded).
+    shared = [path for path in paths if not in_compressed_tar(path)]
+    if len(shared) < PARALLEL_DATE_SCAN:
+        return [read_date(path) for path in paths]
+    chunksize = max(1, len(shared) // (parse_pool.max_workers * 8))
+    executor = parse_pool.executor()
+    try:
+        dates = dict(zip(shared, executor.map(read_date, shared, chunksize=chunksize)))
+    except BrokenProcessPool:
+        # Read them all here instead.
+        parse_pool.discard(executor)
+        dates = {}
+    return [dates[path] if path in dates else read_date(path) for path in paths]
+
+
+# Worker processes for parsing .msg files. Their parser is pure Python and
+# CPU bound, so in a thread it would compete with the GUI thread for the GIL
+# and a folder scan would only use one core.
+PARSE_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+OFFLOADED_EXTENSIONS = (".msg",)
+
+
+def in_compressed_tar(file_path):
+    # Whether file_path is a member of a compressed tar. These are never
+    # handed to the workers: a worker has no catalogue of the archive and
+    # would decompress all of it to make its own.
+    container, member = split_locator(file_path)
+    return member is not None and container.lower().endswith(GZIP_ARCHIVE_EXTENSIONS)
+
+
+def is_offloaded(file_path):
+    # Whether the parse pool hands file_path to its workers.
+    return file_path.lower().endswith(OFFLOADED_EXTENSIONS) and not in_compressed_tar(file_path)
+
+
+class ParsePool:
+    # A process pool started on first use. Everything sent to it is a
+    # module-level function of a path, and everything returned is plain
+    # dicts, lists and strings, so results pickle cheaply.
+    def __init__(self, max_workers=PARSE_WORKERS):
+        self.max_workers = max_workers
+        self._executor = None
+        self._started = None
+        self._lock = threading.Lock()
+
+    def executor(self, wait=True):
+        # The pool, starting it if needed. With wait=False, None is returned
+        # until the workers are up, so an interactive caller can parse the
+        # file itself instead of waiting for process startup.
+        with self._lock:
+            if self._executor is None:
+                # Workers are spawned, not forked: a fork copies locks that
+                # other threads hold at that moment, such as
+                # _catalogues_lock, and the worker would hang on them.
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+                self._started = self._executor.submit(os.getpid)
+            executor, started = self._executor, self._started
+        if not wait and not started.done():
+            return None
+        return executor
+
+    def parse(self, file_path):
+        # parse_email_file, in a worker process for the formats that need it.
+        if not is_offloaded(file_path):
+            return parse_email_file(file_path)
+        executor = self.executor(wait=False)
+        if executor is None:
+            return parse_email_file(file_path)
+        try:
+            return executor.submit(parse_email_file, file_path).result()
+        except BrokenProcessPool:
+            self.discard(executor)
+            raise
+
+    def map(self, func, paths):
+        # Yields (path, func(path)) for each path, in order, with None as the
+        # result when func fails. The offloaded formats go to the workers
+        # while the rest are handled on the calling thread.
+        offloaded = [path for path in paths if is_offloaded(path)]
+        futures = {}
+        if len(offloaded) > 1:
+            executor = self.executor()
+            try:
+                futures = {path: executor.submit(func, path) for path in offloaded}
+            except BrokenProcessPool:
+                # Handle them all here instead.
+                self.discard(executor)
+                futures = {}
+        for path in paths:
+            try:
+                future = futures.get(path)
+                yield path, future.result() if future is not None else func(path)
+            except BrokenProcessPool:
+                self.discard(executor)
+                yield path, None
+            except Exception:
+                yield path, None
+
+    def discard(self, executor):
+        # Drops a pool that broke because a worker died, so that the next
+        # call starts a new one instead of failing as well.
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+parse_pool = ParsePool()
+
+
+def file_signature(file_path):
+    # Identifies one version of a file; a parsed result is only reused while
+    # the file's size and mtime are unchanged.
+    # For a message in a container, that is the container's size and mtime.
+    try:
+        st = os.stat(split_locator(file_path)[0])
+    except OSError:
+        return None
+    return (path_key(file_path), st.st_size, st.st_mtime_ns)
+
+
+def message_size(message):
+    # Rough number of bytes a parsed message keeps alive, used to bound the
+    # cache by memory rather than by entry count.
+    size = sys.getsizeof(message) + sys.getsizeof(message.body) + sys.getsizeof(message.header_values)
+    for value in message.header_values:
+        size += sys.getsizeof(value)
+    size += sys.getsizeof(message.attachments) + sys.getsizeof(message.resources)
+    for attachment in message.attachments:
+        size += sys.getsizeof(attachment) + sys.getsizeof(attachment.filename)
+    return size
+
+
+# Memory budget for parsed messages kept around for revisits.
+MESSAGE_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class MessageCache:
+    # LRU cache of parsed messages keyed by file_signature, evicting the least
+    # recently used entries once the total size exceeds max_bytes. Entries
+    # bigger than a quarter of the budget are not cached at all, so a few huge
+    # messages cannot flush everything else. Shared with the prefetch
+    # threads, hence the lock.
+    def __init__(self, max_bytes=MESSAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # signature -> (message, size)
+        self._lock = threading.Lock()
+
+    def __contains__(self, signature):
+        with self._lock:
+            return signature in self._entries
+
+    def get(self, signature):
+        with self._lock:
+            entry = self._entries.get(signature)
+            if entry is None:
+                return None
+            self._entries.move_to_end(signature)
+            return entry[0]
+
+    def put(self, signature, message):
+        if signature is None:
+            return
+        size = message_size(message)
+        with self._lock:
+            old = self._entries.pop(signature, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            if size > self.max_bytes // 4:
+                return
+            self._entries[signature] = (message, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+
+# Number of files on each side of the current one to parse ahead of time.
+PREFETCH_DEPTH = 2
+
+
+class Prefetcher:
+    # Parses the files around the current one on a small thread pool into the
+    # message cache so that Next/Previous find a ready result instead of
+    # parsing on the GUI thread. Pending work for files that have left the
+    # window around the current file is cancelled.
+    def __init__(self, cache, depth=PREFETCH_DEPTH, max_workers=2):
+        self.cache = cache
+        self.depth = depth
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="emlee-prefetch")
+        self.futures = {}  # file_signature -> Future
+
+    def schedule(self, folder_index, current_path):
+        if self.depth <= 0 or folder_index is None or len(folder_index) < 2:
+            return
+        # Nearest neighbours first, favouring the Next direction.
+        wanted = {}
+        for distance in range(1, self.depth + 1):
+            for step in (distance, -distance):
+                path = folder_index.neighbour(current_path, step)
+                if path and path_key(path) != path_key(current_path):
+                    signature = file_signature(path)
+                    if signature:
+                        wanted.setdefault(signature, path)
+        for signature in list(self.futures):
+            if signature not in wanted:
+                self.futures.pop(signature).cancel()
+        for signature, path in wanted.items():
+            if signature not in self.futures and signature not in self.cache:
+                self.futures[signature] = self.executor.submit(self._prefetch, signature, path)
+
+    def _prefetch(self, signature, path):
+        message = parse_pool.parse(path)
+        self.cache.put(signature, message)
+        return message
+
+    def take(self, signature):
+        # Hands over the prefetch still in flight for signature, if any, so
+        # the caller can wait for it instead of parsing the same file again.
+        future = self.futures.pop(signature, None)
+        if future is None or future.cancelled():
+            return None
+        return future
+
+    def shutdown(self):
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
+        self.executor.shutdown(wait=False)
+
+
+def user_cache_dir():
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "Emlee")
+
+
+class MetadataIndex:
+    # Persistent SQLite index of per-file metadata (size, mtime, headers and
+    # attachment names), kept in the user cache directory so that what Emlee
+    # learns about a folder survives restarts. A background thread scans a
+    # folder and only re-reads files whose size or mtime changed; rows are
+    # ignored as stale when the file on disk no longer matches them.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            key TEXT UNIQUE NOT NULL,
+            path TEXT NOT NULL,
+            directory TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL,
+            message_size INTEGER,
+            sender TEXT,
+            recipients TEXT,
+            cc TEXT,
+            bcc TEXT,
+            subject TEXT,
+            date TEXT,
+            message_id TEXT,
+            attachments TEXT,
+            text_mtime INTEGER,
+            date_ts REAL
+        );
+        CREATE INDEX IF NOT EXISTS messages_directory ON messages (directory);
+    """
+
+    # Full-text index over the headers and the text of the body, filled in
+    # by a second, slower pass of the scan since it needs a full parse. Its
+    # rowid is the id of the message's row in `messages`. Left out when
+    # SQLite was built without FTS5.
+    FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS message_text USING fts5 (
+            sender, recipients, subject, body
+        );
+    """
+
+    # Characters of body text indexed per message.
+    TEXT_LIMIT = 256 * 1024
+
+    # Rows written per transaction while scanning.
+    BATCH_SIZE = 200
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(user_cache_dir(), "index.sqlite3")
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._local = threading.local()
+        self._stop = threading.Event()
+        conn = self.connect()
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(messages)")}
+        # An index made by an earlier version is only a cache, so it is
+        # rebuilt rather than converted.
+        if columns and not {"id", "message_size"} <= columns:
+            conn.executescript("DROP TABLE IF EXISTS message_text; DROP TABLE messages;")
+        conn.executescript(self.SCHEMA)
+        try:
+            conn.executescript(self.FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            print("Warning: SQLite has no FTS5 support. Search will be disabled.")
+            self.fts = False
+
+    def connect(self):
+        # SQLite connections cannot be shared between threads, so each thread
+        # gets its own.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def lookup(self, file_path):
+        # The row for file_path, or None if there is none or it is stale.
+        signature = file_signature(file_path)
+        if signature is None:
+            return None
+        row = self.connect().execute(
+            "SELECT * FROM messages WHERE key = ?", (signature[0],)).fetchone()
+        if row is None or (row["size"], row["mtime"]) != signature[1:]:
+            return None
+        return row
+
+    def directory_rows(self, directory):
+        # All rows of a directory by key, current or not, for bulk sorting.
+        rows = self.connect().execute(
+            "SELECT * FROM messages WHERE directory = ?", (path_key(directory),))
+        return {row["key"]: row for row in rows}
+
+    def scan(self, directory, paths):
+        # Brings the rows for `paths` up to date on a background thread,
+        # stopping any scan that is still running.
+        self.stop()
+        self._stop = threading.Event()
+        thread = threading.Thread(target=self._scan, args=(directory, list(paths), self._stop),
+                                  name="emlee-index", daemon=True)
+        thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _scan(self, directory, paths, stop):
+        directory_key = path_key(directory)
+        try:
+            conn = self.connect()
+            known = {row["key"]: (row["size"], row["mtime"]) for row in conn.execute(
+                "SELECT key, size, mtime FROM messages WHERE directory = ?", (directory_key,))}
+            present = set()
+            stale = {}
+            for path in paths:
+                signature = file_signature(path)
+                if signature is None:
+                    continue
+                present.add(signature[0])
+                if known.get(signature[0]) != signature[1:]:
+                    stale[path] = signature
+            stale_paths = list(stale)
+            for start in range(0, len(stale_paths), self.BATCH_SIZE):
+                if stop.is_set():
+                    return
+                batch = []
+                for path, metadata in parse_pool.map(read_metadata, stale_paths[start:start + self.BATCH_SIZE]):
+                    # Unreadable files are simply not indexed.
+                    if metadata is not None:
+                        batch.append(self._row(path, directory_key, stale[path], metadata))
+                self._store(conn, batch)
+            removed = [(key,) for key in known if key not in present]
+            if removed and not stop.is_set():
+                with conn:
+                    self._remove_text(conn, removed)
+                    conn.executemany("DELETE FROM messages WHERE key = ?", removed)
+            if self.fts:
+                self._index_text(conn, directory_key, stop)
+        except sqlite3.Error as e:
+            print(f"Error updating the message index: {e}")
+        finally:
+            self.close()
+
+    def _index_text(self, conn, directory_key, stop):
+        # Second pass: parse the files whose text is not indexed at their
+        # current mtime, using the same parser as the viewer.
+        pending = conn.execute(
+            "SELECT id, path, mtime, sender, recipients, subject FROM messages "
+            "WHERE directory = ? AND (text_mtime IS NULL OR text_mtime != mtime)",
+            (directory_key,)).fetchall()
+        for start in range(0, len(pending), self.BATCH_SIZE):
+            if stop.is_set():
+                return
+            rows = {row["path"]: row for row in pending[start:start + self.BATCH_SIZE]}
+            batch = [(rows[path], body or "") for path, body in parse_pool.map(read_text, list(rows))]
+            self._store_text(conn, batch)
+
+    def _store_text(self, conn, batch):
+        if not batch:
+            return
+        with conn:
+            conn.executemany("DELETE FROM message_text WHERE rowid = ?",
+                             [(row["id"],) for row, _ in batch])
+            conn.executemany(
+                "INSERT INTO message_text (rowid, sender, recipients, subject, body) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(row["id"], row["sender"], row["recipients"], row["subject"], body)
+                 for row, body in batch])
+            conn.executemany("UPDATE messages SET text_mtime = ? WHERE id = ?",
+                             [(row["mtime"], row["id"]) for row, _ in batch])
+
+    def _remove_text(self, conn, keys):
+        # Drops the indexed text of the messages with these keys, before
+        # their rows are deleted or replaced.
+        if self.fts:
+            conn.executemany(
+                "DELETE FROM message_text WHERE rowid = (SELECT id FROM messages WHERE key = ?)", keys)
+
+    def search(self, text, directory, limit=500):
+        # Paths, subjects, senders and dates of the messages in `directory`
+        # matching every word of `text` (the last one as a prefix), best
+        # matches first.
+        query = fts_query(text)
+        if not self.fts or not query:
+            return []
+        return self.connect().execute(
+            "SELECT m.path, m.subject, m.sender, m.date FROM message_text "
+            "JOIN messages AS m ON m.id = message_text.rowid "
+            "WHERE message_text MATCH ? AND m.directory = ? "
+            "ORDER BY rank LIMIT ?",
+            (query, path_key(directory), limit)).fetchall()
+
+    def directory_dates(self, directory):
+        # read_date values known for the files of a directory, by key.
+        rows = self.connect().execute(
+            "SELECT key, date_ts FROM messages WHERE directory = ? AND date_ts IS NOT NULL",
+            (path_key(directory),))
+        return {row["key"]: row["date_ts"] for row in rows}
+
+    def _row(self, path, directory_key, signature, metadata):
+        headers = metadata["headers"]
+        date_ts = date_timestamp(headers["Date"])
+        if date_ts is None:
+            date_ts = signature[2] / 1e9
+        # size and mtime are those of the file on disk, which for a message
+        # in a container is the container's; message_size is the message's.
+        return (signature[0], path, directory_key, signature[1], signature[2], metadata["size"],
+                headers["From"], headers["To"], headers["Cc"], headers["Bcc"], headers["Subject"],
+                headers["Date"], headers["Message-ID"], "\n".join(metadata["attachments"]), date_ts)
+
+    def _store(self, conn, rows):
+        if rows:
+            with conn:
+                # The replaced rows get new ids and their text is indexed
+                # again, so the old text goes.
+                self._remove_text(conn, [(row[0],) for row in rows])
+                conn.executemany(
+                    "INSERT OR REPLACE INTO messages (key, path, directory, size, mtime, message_size, "
+                    "sender, recipients, cc, bcc, subject, date, message_id, attachments, date_ts) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def read_text(file_path):
+    # The plain text that is indexed for a file's body.
+    return html_to_text(parse_email_file(file_path).body)[:MetadataIndex.TEXT_LIMIT]
+
+
+def fts_query(text):
+    # Turns free text typed into the search box into an FTS5 query: each word
+    # is quoted so FTS5 operators and punctuation are taken literally.
+    words = text.split()
+    if not words:
+        return ""
+    terms = ['"' + word.replace('"', '""') + '"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
@@ -1,19 +1,489 @@
+import time
+
+# Taken before the other imports so the startup time includes them.
+STARTED = time.perf_counter()
+
 import sys
 import os
-import glob
-import tempfile
-import html
+import struct
+import sqlite3
+import threading
+import contextlib
+import concurrent.futures
 from PyQt5 import QtCore, QtWidgets, QtGui
-import email
-from email import policy
-from email.parser import BytesParser
+from emlee_core import (
+    ARCHIVE_EXTENSIONS, MBOX_EXTENSIONS, AttachmentCache, MboxIndex, MessageCache, MetadataIndex,
+    Prefetcher, email_extensions, extract_attachment, extract_attachments, file_signature,
+    archive_catalogue, format_size, has_archive_catalogue, header_reader, is_archive,
+    is_container, is_mbox_file, message_kind, message_source, open_index, parse_eml, parse_pool, path_key, read_inline, read_metadata,
+    safe_filename, scan_dates, split_locator, unique_filenames,
+)
+
+
+# Longest body handed to the body view in one go. QTextBrowser lays out
+# HTML at roughly 2-3 ms per KB of table-heavy markup, so longer bodies are
+# cut here and the rest is only rendered on request.
+BODY_PREVIEW_CHARS = 100 * 1000
+SHOW_FULL_URL = "emlee:show-full-message"
+# Links in a message body that are handed to the OS. Anything else, such as
+# file: or UNC links that would run a program, is ignored.
+EXTERNAL_LINK_SCHEMES = ("http", "https", "mailto")
+
+
+def preview_body(body, limit=BODY_PREVIEW_CHARS):
+    # Returns (html, truncated): the body itself when it is short enough,
+    # otherwise its start, cut before a tag or at a line break so no markup
+    # is split.
+    if len(body) <= limit:
+        return body, False
+    cut = body.rfind("<", 0, limit)
+    if cut < limit // 2:
+        cut = body.rfind("\n", 0, limit)
+    if cut < limit // 2:
+        cut = limit
+    preview = body[:cut]
+    if body.startswith("<pre>"):
+        preview += "</pre>"
+    return preview, True
+
+
+class CancelToken:
+    # Shared between the GUI and a load running on the thread pool. Starting
+    # a new load cancels the previous token, so a stale load stops at its
+    # next check and its result is never displayed.
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class LoadTimings:
+    # How long each stage of opening one message took: the folder index,
+    # waiting on the load pool, reading the headers, the parse, rendering the
+    # body and so on. Stages run on the GUI thread and on the load pool, so
+    # spans are added under a lock. Shown in the status bar with View > Show
+    # Timings and written to the timing log.
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.started = time.perf_counter()
+        self.finished = None
+        self.spans = []  # (stage, seconds), in the order they ended.
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.spans.append((stage, seconds))
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def stages(self):
+        # Seconds per stage in the order they first ended; a stage that ran
+        # more than once is added up.
+        totals = {}
+        with self.lock:
+            for stage, seconds in self.spans:
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        return totals
+
+    def summary(self):
+        parts = [f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in self.stages().items()]
+        if self.finished is not None:
+            parts.append(f"total {(self.finished - self.started) * 1000:.1f} ms")
+        return " | ".join(parts)
+
+    def record(self, event):
+        total = None if self.finished is None else round((self.finished - self.started) * 1000, 3)
+        return {"time": round(time.time(), 3), "event": event, "path": self.file_path, "total_ms": total,
+                "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in self.stages().items()}}
+
+
+class TimingLog:
+    # Appends one JSON object per line, one line per message opened or
+    # attachment written, for analysing timings offline.
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, record):
+        import json
+        with open(self.path, "a", encoding="utf-8") as out:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class LoadSignals(QtCore.QObject):
+    # QRunnable is not a QObject, so the task reports back through this.
+    # Arguments: token, file path, headers / parsed message / error text.
+    headers = QtCore.pyqtSignal(object, str, object)
+    finished = QtCore.pyqtSignal(object, str, object)
+    failed = QtCore.pyqtSignal(object, str, str)
+
+
+class LoadTask(QtCore.QRunnable):
+    # Parses one file on the load thread pool in two phases: the header block
+    # first, reported through the headers signal so the header pane can be
+    # painted right away, then the full message. If a prefetch of the same
+    # file is already running, its result is awaited instead of parsing again.
+    def __init__(self, file_path, parse, read_headers, cache, pending, token, timings):
+        super().__init__()
+        self.file_path = file_path
+        self.parse = parse
+        self.read_headers = read_headers
+        self.cache = cache
+        self.pending = pending
+        self.token = token
+        self.timings = timings
+        self.queued = time.perf_counter()
+        self.signals = LoadSignals()
+
+    def run(self):
+        self.timings.add("queued", time.perf_counter() - self.queued)
+        if self.token.cancelled:
+            return
+        try:
+            message = None
+            if self.pending is not None:
+                try:
+                    with self.timings.span("prefetch wait"):
+                        message = self.pending.result()
+                except Exception:
+                    message = None
+            if message is None:
+                if self.read_headers is not None:
+                    with self.timings.span("headers"):
+                        headers = self.read_headers(self.file_path)
+                    if self.token.cancelled:
+                        return
+                    self.signals.headers.emit(self.token, self.file_path, headers)
+                if self.token.cancelled:
+                    return
+                with self.timings.span("parse"):
+                    message = self.parse(self.file_path)
+                self.cache.put(file_signature(self.file_path), message)
+        except Exception as e:
+            if not self.token.cancelled:
+                self.signals.failed.emit(self.token, self.file_path, str(e))
+            return
+        if not self.token.cancelled:
+            self.signals.finished.emit(self.token, self.file_path, message)
+
+
+def column_sort_key(column, row):
+    # Sort key of a message list column, from the message's metadata index row.
+    if column == 0:
+        return (row["sender"] or "").lower()
+    if column == 1:
+        return (row["subject"] or "").lower()
+    if column == 3:
+        return row["message_size"]
+    return len(row["attachments"].split("\n")) if row["attachments"] else 0
+
+
+class MessageListModel(QtCore.QAbstractTableModel):
+    # Table of the emails in the current folder, in the folder index's order.
+    # Nothing is read up front: a row's metadata is fetched the first time
+    # the view asks for it, i.e. only for rows that are actually shown, from
+    # the metadata index when it has the file and otherwise by reading the
+    # file on a background thread. Sorting reorders the folder index itself,
+    # so Next/Previous follow the order of the list.
+    COLUMNS = ("From", "Subject", "Date", "Size", "Attachments")
+
+    row_loaded = QtCore.pyqtSignal(str, object)
+    # Emitted with the folder index when sorting by date needs its dates
+    # scanned first.
+    dates_needed = QtCore.pyqtSignal(object)
+
+    def __init__(self, metadata_index, parent=None):
+        super().__init__(parent)
+        self.metadata_index = metadata_index
+        self.folder_index = None
+        self._values = {}     # path_key(path) -> tuple of column values
+        self._pending = set()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="emlee-list")
+        self.row_loaded.connect(self._on_row_loaded)
+
+    def set_folder(self, folder_index):
+        self.beginResetModel()
+        if folder_index is not self.folder_index:
+            self._values = {}
+        self.folder_index = folder_index
+        self.endResetModel()
+
+    def path(self, row):
+        return self.folder_index.files[row]
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid() or self.folder_index is None:
+            return 0
+        return len(self.folder_index)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role not in (QtCore.Qt.DisplayRole, QtCore.Qt.ToolTipRole):
+            return None
+        path = self.folder_index.files[index.row()]
+        values = self._values.get(path_key(path))
+        if values is None:
+            self._request(path)
+            return os.path.basename(path) if index.column() == 1 else ""
+        sender, subject, date, size, attachment_count = values
+        column = index.column()
+        if column == 0:
+            return sender
+        if column == 1:
+            return subject or "(no subject)"
+        if column == 2:
+            return date
+        if column == 3:
+            return format_size(size)
+        return str(attachment_count) if attachment_count else ""
+
+    def _request(self, path):
+        key = path_key(path)
+        if key not in self._pending:
+            self._pending.add(key)
+            self._executor.submit(self._load_row, path)
+
+    def _load_row(self, path):
+        # Runs on the model's worker thread.
+        try:
+            row = self.metadata_index.lookup(path) if self.metadata_index else None
+            if row is not None:
+                names = row["attachments"]
+                values = (row["sender"], row["subject"], row["date"], row["message_size"],
+                          len(names.split("\n")) if names else 0)
+            else:
+                metadata = read_metadata(path)
+                headers = metadata["headers"]
+                values = (headers["From"], headers["Subject"], headers["Date"],
+                          metadata["size"], len(metadata["attachments"]))
+        except Exception:
+            values = ("", os.path.basename(path), "", None, 0)
+        self.row_loaded.emit(path, values)
+
+    def _on_row_loaded(self, path, values):
+        key = path_key(path)
+        self._pending.discard(key)
+        self._values[key] = values
+        if self.folder_index is not None:
+            row = self.folder_index.index_of(path)
+            if row >= 0:
+                self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.COLUMNS) - 1))
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        if self.folder_index is None:
+            return
+        # Sorting needs a key for every file, which comes from the metadata
+        # index in one query; files it does not know yet sort first.
+        if column < 0:
+            self.sort_by_name()
+            return
+        if column == 2:
+            self.sort_by_date(order == QtCore.Qt.DescendingOrder)
+            return
+        rows = self.metadata_index.directory_rows(self.folder_index.directory) \
+            if self.metadata_index else {}
+        # Only the keys are kept, as the folder index holds on to key_func.
+        keys = {key: column_sort_key(column, row) for key, row in rows.items()}
+        fallback = {0: "", 1: "", 3: 0, 4: 0}[column]
+
+        def key_func(path):
+            return keys.get(path_key(path), fallback)
+
+        self.layoutAboutToBeChanged.emit()
+        self.folder_index.sort_by(key_func, reverse=order == QtCore.Qt.DescendingOrder)
+        self.layoutChanged.emit()
+
+    def sort_by_date(self, reverse=False):
+        # Until the folder's dates are scanned, sorting would read every file
+        # here on the GUI thread; the sort is done once the scan finishes.
+        if not self.folder_index.dates_scanned:
+            self.dates_needed.emit(self.folder_index)
+            return
+        self.layoutAboutToBeChanged.emit()
+        self.folder_index.sort_by(self.folder_index.date_key, reverse=reverse)
+        self.layoutChanged.emit()
+
+    def sort_by_name(self):
+        self.layoutAboutToBeChanged.emit()
+        self.folder_index.sort_by(None)
+        self.layoutChanged.emit()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class CatalogueSignals(QtCore.QObject):
+    # Argument: the error text, empty when the catalogue was read.
+    finished = QtCore.pyqtSignal(str)
+
+
+class CatalogueTask(QtCore.QRunnable):
+    # Reads the catalogue of an archive (see archive_catalogue) on the thread
+    # pool, where it is cached for the GUI thread to use. A compressed tar is
+    # decompressed in full to list its members.
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.signals = CatalogueSignals()
+
+    def run(self):
+        try:
+            archive_catalogue(self.path)
+            error = ""
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        self.signals.finished.emit(error)
+
+
+class MboxIndexSignals(QtCore.QObject):
+    # Arguments: the MboxIndex, the result of its rescan (None for a new
+    # index) and the error text, empty when the mbox was indexed.
+    finished = QtCore.pyqtSignal(object, object, str)
+
+
+class MboxIndexTask(QtCore.QRunnable):
+    # Indexes an mbox file on the thread pool: opens a new MboxIndex, or
+    # rescans an existing one for the GUI thread to apply with
+    # MboxIndex.update. Finding the messages of a large mailbox means
+    # searching all of it for separator lines.
+    def __init__(self, path, index):
+        super().__init__()
+        self.path = path
+        self.index = index
+        self.signals = MboxIndexSignals()
+
+    def run(self):
+        index, scan, error = self.index, None, ""
+        try:
+            if index is None:
+                index = MboxIndex(self.path)
+            else:
+                scan = index.rescan()
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        self.signals.finished.emit(index, scan, error)
+
+
+class DateScanSignals(QtCore.QObject):
+    # Arguments: folder index, dict of path_key(path) -> read_date(path).
+    finished = QtCore.pyqtSignal(object, object)
+
+
+class DateScanTask(QtCore.QRunnable):
+    # Collects the dates of a folder for chronological sorting: from the
+    # metadata index for the files it knows, and by reading just the headers
+    # of the others in parallel.
+    def __init__(self, folder_index, metadata_index):
+        super().__init__()
+        self.folder_index = folder_index
+        self.metadata_index = metadata_index
+        self.paths = list(folder_index.files)
+        self.signals = DateScanSignals()
+
+    def run(self):
+        dates = {}
+        if self.metadata_index is not None:
+            try:
+                dates = self.metadata_index.directory_dates(self.folder_index.directory)
+            except sqlite3.Error:
+                dates = {}
+        missing = [path for path in self.paths if path_key(path) not in dates]
+        dates.update(zip(map(path_key, missing), scan_dates(missing)))
+        self.signals.finished.emit(self.folder_index, dates)
+
+
+# How long resizing has to pause before the body is laid out again.
+RELAYOUT_DELAY_MS = 150
+
+
+class BodyView(QtWidgets.QTextBrowser):
+    # The message body view. Laying out a long HTML document takes a while,
+    # so the document is wrapped at a fixed width that is only updated once
+    # resizing pauses, instead of on every pixel of a window or splitter
+    # drag. The width always leaves room for the scrollbar, so the scrollbar
+    # appearing after a message is shown does not cause a second layout.
+    #
+    # Inline images (cid: URLs) are decoded from the message file when the
+    # document first asks for them and kept for as long as the same message
+    # is shown, so re-rendering it (Show full message) does not decode them
+    # again.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.resource_source = None
+        self.resources = {}
+        self.images = {}
+        self.setLineWrapMode(QtWidgets.QTextEdit.FixedPixelWidth)
+        self.relayout_timer = QtCore.QTimer(self)
+        self.relayout_timer.setSingleShot(True)
+        self.relayout_timer.setInterval(RELAYOUT_DELAY_MS)
+        self.relayout_timer.timeout.connect(self.relayout)
+
+    def wrap_width(self):
+        scrollbar = 0 if self.verticalScrollBar().isVisible() else \
+            self.style().pixelMetric(QtWidgets.QStyle.PM_ScrollBarExtent, None, self)
+        return max(1, self.viewport().width() - scrollbar)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.relayout_timer.start()
+
+    def relayout(self):
+        width = self.wrap_width()
+        if width != self.lineWrapColumnOrWidth():
+            self.setLineWrapColumnOrWidth(width)
+
+    def set_message(self, file_path, resources):
+        resources = dict(resources)
+        if file_path != self.resource_source or resources != self.resources:
+            self.resource_source = file_path
+            self.resources = resources
+            self.images = {}
+
+    def loadResource(self, resource_type, url):
+        if resource_type == QtGui.QTextDocument.ImageResource and url.scheme().lower() == "cid":
+            image = self.inline_image(url.path())
+            return image if not image.isNull() else None
+        return super().loadResource(resource_type, url)
+
+    def inline_image(self, content_id):
+        image = self.images.get(content_id)
+        if image is None:
+            image = QtGui.QImage()
+            where = self.resources.get(content_id)
+            if where is not None:
+                try:
+                    image.loadFromData(read_inline(self.resource_source, where))
+                except (OSError, ValueError, IndexError, TypeError, struct.error):
+                    pass
+            self.images[content_id] = image
+        return image
+
+    def show_html(self, body):
+        # Replaces the document, laying the new one out exactly once.
+        self.relayout_timer.stop()
+        if self.wrap_width() != self.lineWrapColumnOrWidth():
+            # Clear first so the old document is not laid out again.
+            self.clear()
+            self.setLineWrapColumnOrWidth(self.wrap_width())
+        self.setHtml(body)
 
-# For .msg support. Make sure to install extract_msg via pip.
-try:
-    import extract_msg
-except ImportError:
-    extract_msg = None
-    print("Warning: extract_msg module not found. .msg file support will be disabled.")
 
 class EmailViewer(QtWidgets.QMainWindow):
     def __init__(self):
@@ -26,13 +496,54 @@ class EmailViewer(QtWidgets.QMainWindow):
         icon_path = os.path.join(os.path.dirname(__file__), "icon.ico")
         self.setWindowIcon(QtGui.QIcon(icon_path))
 
-        # Track current file and list of email files (.eml and .msg).
+        # Track current file and the index of email files (.eml and .msg) in
+        # its folder. Indexes are kept per directory so revisiting a folder
+        # does not rescan it, and a watcher marks them dirty on changes.
         self.current_email_path = None
-        self.email_files_list = []
+        self.folder_indexes = {}
+        self.watched_indexes = {}
+        self.date_scans = set()   # Folder indexes whose dates are being scanned.
+        # Timings of the message being opened or shown, and where to log
+        # them, if anywhere. EMLEE_TIMING_LOG=<file> turns the log on at
+        # startup.
+        self.load_timings = None
+        self.timings_label = None
+        log_path = os.environ.get("EMLEE_TIMING_LOG")
+        self.timing_log = TimingLog(log_path) if log_path else None
+        self.folder_index = None
         self.current_index = -1
+        self.folder_watcher = QtCore.QFileSystemWatcher(self)
+        self.folder_watcher.directoryChanged.connect(self.on_directory_changed)
+
+        # Recently parsed messages, and a prefetcher that fills the cache with
+        # the neighbouring files in the background while one is displayed.
+        self.message_cache = MessageCache()
+        self.prefetcher = Prefetcher(self.message_cache)
+
+        # Persistent per-file metadata, filled in by a background scan of each
+        # folder that is opened. Emlee works without it if the database
+        # cannot be opened.
+        try:
+            self.metadata_index = MetadataIndex()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning: message index not available: {e}")
+            self.metadata_index = None
 
-        # Mapping of attachment filename to temporary file path.
-        self.attachments = {}
+        # Messages are parsed on this pool, never on the GUI thread. Only the
+        # most recent load is allowed to display its result.
+        self.load_pool = QtCore.QThreadPool(self)
+        self.load_pool.setMaxThreadCount(2)
+        self.load_task = None
+        self.load_token = CancelToken()
+
+        # Attachments of the displayed email, in list order, and the file
+        # they come from. They are only extracted when opened or saved, and
+        # opened ones are kept in the attachment cache for later views.
+        self.attachments = []
+        self.attachments_source = None
+        self.attachment_cache = AttachmentCache()
+        # Trimming walks the whole cache, so keep it off the startup path.
+        threading.Thread(target=self.attachment_cache.trim, daemon=True).start()
 
         self.init_ui()
         self.setAcceptDrops(True)
@@ -41,8 +552,33 @@ class EmailViewer(QtWidgets.QMainWindow):
         # File menu with "Open File" action.
         open_action = QtWidgets.QAction("Open File", self)
         open_action.triggered.connect(self.open_file_dialog)
+        save_attachments_action = QtWidgets.QAction("Save Attachments...", self)
+        save_attachments_action.triggered.connect(self.save_all_attachments)
         file_menu = self.menuBar().addMenu("File")
         file_menu.addAction(open_action)
+        file_menu.addAction(save_attachments_action)
+
+        # View menu: folders are shown in Date header order unless switched
+        # to file name order.
+        self.sort_by_date_action = QtWidgets.QAction("Sort by Date", self)
+        self.sort_by_date_action.setCheckable(True)
+        self.sort_by_date_action.setChecked(True)
+        self.sort_by_date_action.toggled.connect(self.on_sort_by_date_toggled)
+        view_menu = self.menuBar().addMenu("View")
+        view_menu.addAction(self.sort_by_date_action)
+
+        # How long the stages of opening the current message took, in the
+        # status bar, and a log of them for every message.
+        view_menu.addSeparator()
+        self.show_timings_action = QtWidgets.QAction("Show Timings", self)
+        self.show_timings_action.setCheckable(True)
+        self.show_timings_action.toggled.connect(self.on_show_timings_toggled)
+        view_menu.addAction(self.show_timings_action)
+        self.log_timings_action = QtWidgets.QAction("Log Timings to File...", self)
+        self.log_timings_action.setCheckable(True)
+        self.log_timings_action.setChecked(self.timing_log is not None)
+        self.log_timings_action.toggled.connect(self.on_log_timings_toggled)
+        view_menu.addAction(self.log_timings_action)
 
         # Create central widget and a vertical layout.
         central_widget = QtWidgets.QWidget(self)
@@ -51,6 +587,59 @@ class EmailViewer(QtWidgets.QMainWindow):
         main_layout.setContentsMargins(5, 5, 5, 5)
         main_layout.setSpacing(5)
 
+        # --- Search Section ---
+        # Full-text search over the current folder; results are listed below
+        # the box and open on activation.
+        self.search_box = QtWidgets.QLineEdit()
+        self.search_box.setPlaceholderText("Search this folder...")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.returnPressed.connect(self.run_search)
+        self.search_box.textChanged.connect(self.on_search_text_changed)
+        main_layout.addWidget(self.search_box)
+        self.search_results = QtWidgets.QListWidget()
+        self.search_results.setMaximumHeight(150)
+        self.search_results.itemActivated.connect(self.open_search_result)
+        self.search_results.hide()
+        main_layout.addWidget(self.search_results)
+
+        # --- Message List Section ---
+        # The folder's emails above the viewer, split by a movable divider.
+        # The model only reads the rows that are on screen.
+        splitter = QtWidgets.QSplitter(QtCore.Qt.Vertical)
+        self.message_model = MessageListModel(self.metadata_index, self)
+        self.message_model.dates_needed.connect(self.scan_folder_dates)
+        self.message_list = QtWidgets.QTableView()
+        self.message_list.setModel(self.message_model)
+        self.message_list.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.message_list.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.message_list.setSortingEnabled(True)
+        self.message_list.horizontalHeader().setSortIndicator(-1, QtCore.Qt.AscendingOrder)
+        self.message_list.horizontalHeader().setStretchLastSection(True)
+        self.message_list.verticalHeader().hide()
+        # Fixed row heights, so the view never measures rows it does not show.
+        self.message_list.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+        self.message_list.verticalHeader().setDefaultSectionSize(
+            self.message_list.fontMetrics().height() + 6)
+        self.message_list.setWordWrap(False)
+        self.message_list.setColumnWidth(0, 180)
+        self.message_list.setColumnWidth(1, 300)
+        self.message_list.setColumnWidth(2, 170)
+        self.message_list.setColumnWidth(3, 80)
+        self.message_list.activated.connect(self.open_list_row)
+        self.message_list.clicked.connect(self.open_list_row)
+        # Keep the open email selected when the list is re-sorted.
+        self.message_model.layoutChanged.connect(self.sync_list_selection)
+        splitter.addWidget(self.message_list)
+        viewer_widget = QtWidgets.QWidget()
+        viewer_layout = QtWidgets.QVBoxLayout(viewer_widget)
+        viewer_layout.setContentsMargins(0, 0, 0, 0)
+        viewer_layout.setSpacing(5)
+        splitter.addWidget(viewer_widget)
+        splitter.setStretchFactor(0, 1)
+        splitter.setStretchFactor(1, 3)
+        splitter.setSizes([160, 440])
+        main_layout.addWidget(splitter)
+
         # --- Header Section ---
         # Increased fixed height to accommodate Subject.
         self.header_widget = QtWidgets.QWidget()
@@ -71,19 +660,24 @@ class EmailViewer(QtWidgets.QMainWindow):
         header_layout.addWidget(self.label_bcc, 1, 1)
         header_layout.addWidget(self.label_subject, 2, 0, 1, 2)
         header_layout.addWidget(self.label_date, 3, 0, 1, 2)
-        main_layout.addWidget(self.header_widget)
+        viewer_layout.addWidget(self.header_widget)
 
         # --- Email Body Section ---
         # QTextBrowser renders HTML and includes a scrollbar.
-        self.body_text = QtWidgets.QTextBrowser()
-        self.body_text.setOpenExternalLinks(True)
-        main_layout.addWidget(self.body_text)
+        self.body_text = BodyView()
+        self.body_text.setOpenLinks(False)
+        self.body_text.anchorClicked.connect(self.on_body_link_clicked)
+        # Rest of a body cut short by preview_body, until it is asked for.
+        self.full_body = None
+        viewer_layout.addWidget(self.body_text)
 
         # --- Attachments Section ---
         self.attachments_list = QtWidgets.QListWidget()
         self.attachments_list.setMaximumHeight(100)
         self.attachments_list.itemDoubleClicked.connect(self.open_attachment)
-        main_layout.addWidget(self.attachments_list)
+        self.attachments_list.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
+        self.attachments_list.customContextMenuRequested.connect(self.show_attachment_menu)
+        viewer_layout.addWidget(self.attachments_list)
 
         # --- Navigation Buttons at Bottom Right ---
         nav_layout = QtWidgets.QHBoxLayout()
@@ -100,176 +694,498 @@ class EmailViewer(QtWidgets.QMainWindow):
         options = QtWidgets.QFileDialog.Options()
         file_path, _ = QtWidgets.QFileDialog.getOpenFileName(
             self, "Open Email File", "",
-            "Email Files (*.eml *.msg)", options=options)
+            "Email Files (*.eml *.msg);;Mailboxes (*.mbox *.mbx);;"
+            "Archives (*.zip *.tar *.tar.gz *.tgz);;All Files (*)", options=options)
         if file_path:
             self.load_email_file(file_path)
 
     def load_email_file(self, file_path):
-        # Display a loading message before processing.
+        # An archive or mbox file is indexed in the background first; the
+        # load starts over once that is done.
+        source = file_path if is_container(file_path) else message_source(file_path)
+        if not self.prepare_source(source, lambda: self.load_email_file(file_path)):
+            return
+
+        timings = LoadTimings(file_path)
+
+        # An mbox file, a Maildir folder or an archive opens at its first
+        # message.
+        if is_container(file_path):
+            with timings.span("index"):
+                index = self.get_folder_index(file_path)
+            if not len(index):
+                QtWidgets.QMessageBox.warning(self, "Error", "No email files found in it.")
+                return
+            file_path = index.files[0]
+            timings.file_path = file_path
+
+        # Cancel whatever load is still pending or running; its result would
+        # be stale by the time it arrived.
+        self.cancel_load()
+        self.load_timings = timings
+
+        # Display a loading message while the file is parsed in the background.
         self.body_text.setHtml("<p>Loading email, please wait...</p>")
-        QtWidgets.QApplication.processEvents()
+        self.full_body = None
 
         self.current_email_path = file_path
-        self.setWindowTitle(f"Emlee - {os.path.basename(file_path)}")
 
-        # Update file list from the directory, including both .eml and .msg if supported.
-        directory = os.path.dirname(file_path)
-        if extract_msg:
-            patterns = [os.path.join(directory, "*.eml"), os.path.join(directory, "*.msg")]
-        else:
-            patterns = [os.path.join(directory, "*.eml")]
-        files = []
-        for pattern in patterns:
-            files.extend(glob.glob(pattern))
-        self.email_files_list = sorted(files, key=lambda s: s.lower())
-        try:
-            self.current_index = self.email_files_list.index(file_path)
-        except ValueError:
-            self.current_index = -1
+        # Look up the file in the index of its folder, Maildir or mbox.
+        with timings.span("index"):
+            self.folder_index = self.get_folder_index(message_source(file_path))
+            self.current_index = self.folder_index.index_of(file_path)
+            self.select_list_row(self.current_index)
+
+        container, member = split_locator(file_path)
+        title = os.path.basename(container)
+        if member is not None:
+            title += f" ({self.current_index + 1} of {len(self.folder_index)})"
+        self.setWindowTitle(f"Emlee - {title}")
 
         # Clear previous attachments.
         self.attachments_list.clear()
-        self.attachments = {}
+        self.attachments = []
+        self.attachments_source = None
 
-        ext = os.path.splitext(file_path)[1].lower()
+        ext = message_kind(file_path)
         if ext == ".eml":
             self.load_eml(file_path)
         elif ext == ".msg":
-            if extract_msg:
-                self.load_msg(file_path)
-            else:
-                QtWidgets.QMessageBox.warning(self, "Error",
-                                              "MSG file support not available. Please install extract_msg module.")
+            self.load_msg(file_path)
         else:
             QtWidgets.QMessageBox.warning(self, "Error", "Unsupported file format.")
 
-        # Adjust document width to fill available space.
-        self.body_text.document().setTextWidth(self.body_text.viewport().width())
+    def prepare_source(self, source, then):
+        # Whether the index of `source` (see message_source) can be had on
+        # the GUI thread without reading much of it. If not, an archive's
+        # catalogue is read or an mbox file indexed on the load pool, and
+        # `then` is called when that is done, unless another load started
+        # meanwhile.
+        if is_archive(source) and not has_archive_catalogue(source):
+            self.run_before_load(CatalogueTask(source), "Reading archive",
+                                 lambda token, error: self.on_catalogue_read(token, error, then))
+            return False
+        if is_mbox_file(source):
+            index = self.folder_indexes.get(path_key(source))
+            if index is None or index.stale():
+                self.run_before_load(MboxIndexTask(source, index), "Indexing mailbox",
+                                     lambda token, *result: self.on_mbox_indexed(token, *result, then))
+                return False
+        return True
 
-    def load_eml(self, file_path):
-        with open(file_path, 'rb') as f:
-            msg = BytesParser(policy=policy.default).parse(f)
+    def run_before_load(self, task, message, finished):
+        # Runs `task` on the load pool in place of a load, calling
+        # finished(token, *result) with the load's cancel token when it ends.
+        self.cancel_load()
+        self.body_text.setHtml(f"<p>{message}, please wait...</p>")
+        self.full_body = None
+        token = self.load_token = CancelToken()
+        task.signals.finished.connect(lambda *result: finished(token, *result))
+        self.load_task = task
+        self.load_pool.start(task)
 
-        # Update header labels.
-        self.label_from.setText(f"From: {msg.get('From', '')}")
-        self.label_to.setText(f"To: {msg.get('To', '')}")
-        self.label_cc.setText(f"CC: {msg.get('Cc', '')}")
-        self.label_bcc.setText(f"BCC: {msg.get('Bcc', '')}")
-        self.label_subject.setText(f"Subject: {msg.get('Subject', '')}")
-        self.label_date.setText(f"Date: {msg.get('Date', '')}")
-
-        # Extract the email body while preserving formatting.
-        body = ""
-        html_body = None
-        plain_body = None
-        if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_disposition() is None:
-                    if part.get_content_type() == "text/html":
-                        html_body = part.get_content()
-                    elif part.get_content_type() == "text/plain":
-                        plain_body = part.get_content()
-            if html_body:
-                body = html_body
-            elif plain_body:
-                body = "<pre>" + html.escape(plain_body) + "</pre>"
+    def finish_before_load(self, token, error, what):
+        # Whether the load that run_before_load replaced should go on.
+        if token is not self.load_token or token.cancelled:
+            return False
+        self.load_task = None
+        if error:
+            self.body_text.setHtml("")
+            QtWidgets.QMessageBox.warning(self, "Error", f"Could not open {what}:\n{error}")
+            return False
+        return True
+
+    def on_catalogue_read(self, token, error, then):
+        if self.finish_before_load(token, error, "archive"):
+            then()
+
+    def on_mbox_indexed(self, token, index, scan, error, then):
+        if not self.finish_before_load(token, error, "mailbox"):
+            return
+        if scan is None:
+            self.add_folder_index(index)
+            self.folder_index_updated(index, True, opened=True)
+        elif self.folder_indexes.get(path_key(index.directory)) is index:
+            self.folder_index_updated(index, index.update(scan))
+        then()
+
+    def cancel_load(self):
+        self.load_token.cancel()
+        if self.load_task is not None:
+            # Drop it from the queue if it has not started yet.
+            self.load_pool.tryTake(self.load_task)
+            self.load_task = None
+
+    def start_load(self, file_path, parse):
+        timings = self.load_timings
+        with timings.span("cache"):
+            signature = file_signature(file_path)
+            message = self.message_cache.get(signature)
+        if message is not None:
+            self.display_loaded(file_path, message)
+            return
+        # Paint the header pane straight from the index when it knows the file.
+        read_headers = header_reader(file_path)
+        row = None
+        if self.metadata_index is not None:
+            with timings.span("metadata"):
+                row = self.metadata_index.lookup(file_path)
+        if row is not None:
+            self.show_headers({"From": row["sender"], "To": row["recipients"], "Cc": row["cc"],
+                               "Bcc": row["bcc"], "Subject": row["subject"], "Date": row["date"]})
+            read_headers = None
+        self.load_token = CancelToken()
+        task = LoadTask(file_path, parse, read_headers, self.message_cache,
+                        self.prefetcher.take(signature), self.load_token, timings)
+        task.signals.headers.connect(self.on_headers_loaded)
+        task.signals.finished.connect(self.on_load_finished)
+        task.signals.failed.connect(self.on_load_failed)
+        self.load_task = task
+        self.load_pool.start(task)
+
+    def on_headers_loaded(self, token, file_path, headers):
+        if token is not self.load_token or token.cancelled:
+            return
+        self.show_headers(headers)
+
+    def on_load_finished(self, token, file_path, message):
+        if token is not self.load_token or token.cancelled:
+            return
+        self.load_task = None
+        self.display_loaded(file_path, message)
+
+    def on_load_failed(self, token, file_path, error):
+        if token is not self.load_token or token.cancelled:
+            return
+        self.load_task = None
+        self.body_text.setHtml("")
+        self.load_timings.finish()
+        self.report_timings(self.load_timings, "failed")
+        QtWidgets.QMessageBox.warning(self, "Error",
+                                      f"Could not open email:\n{error}")
+
+    def display_loaded(self, file_path, message):
+        self.show_message(file_path, message)
+
+        # The body is laid out and painted once control is back in the
+        # event loop; the timings are complete after that.
+        timings = self.load_timings
+        shown = time.perf_counter()
+        QtCore.QTimer.singleShot(0, lambda: self.finish_timings(timings, shown))
+
+        # Start parsing the neighbours while this one is being read.
+        self.prefetcher.schedule(self.folder_index, file_path)
+
+    def finish_timings(self, timings, shown):
+        timings.add("paint", time.perf_counter() - shown)
+        timings.finish()
+        self.report_timings(timings, "load")
+
+    def report_timings(self, timings, event=None):
+        # Shows timings in the status bar if they belong to the current
+        # message, and with an event name appends them to the timing log.
+        if self.timings_label is not None and timings is self.load_timings:
+            self.timings_label.setText(timings.summary())
+        if event is not None and self.timing_log is not None:
+            try:
+                self.timing_log.write(timings.record(event))
+            except OSError as e:
+                self.statusBar().showMessage(f"Could not write the timing log: {e}", 5000)
+
+    @contextlib.contextmanager
+    def attachment_timings(self):
+        # Times writing attachments of the current message to disk. Each
+        # write is logged on its own and added to the message's timings.
+        timings = LoadTimings(self.attachments_source)
+        try:
+            with timings.span("attachments"):
+                yield
+        finally:
+            timings.finish()
+            current = self.load_timings
+            if current is not None and current.file_path == timings.file_path:
+                current.add("attachments", timings.finished - timings.started)
+                self.report_timings(current)
+            self.report_timings(timings, "attachment")
+
+    def on_show_timings_toggled(self, checked):
+        if self.timings_label is None:
+            self.timings_label = QtWidgets.QLabel()
+            self.statusBar().addPermanentWidget(self.timings_label)
+        self.timings_label.setVisible(checked)
+        if checked and self.load_timings is not None:
+            self.timings_label.setText(self.load_timings.summary())
+
+    def on_log_timings_toggled(self, checked):
+        if not checked:
+            self.timing_log = None
+            return
+        if self.timing_log is not None:
+            return
+        log_path, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Log Timings", "emlee-timings.jsonl", "JSON Lines (*.jsonl);;All Files (*)",
+            options=QtWidgets.QFileDialog.DontConfirmOverwrite)
+        if not log_path:
+            self.log_timings_action.setChecked(False)
+            return
+        self.timing_log = TimingLog(log_path)
+        self.statusBar().showMessage(f"Logging timings to {log_path}", 5000)
+
+    def run_search(self):
+        text = self.search_box.text().strip()
+        self.search_results.clear()
+        if not text or self.metadata_index is None or self.folder_index is None:
+            self.search_results.hide()
+            return
+        try:
+            rows = self.metadata_index.search(text, self.folder_index.directory)
+        except sqlite3.Error as e:
+            self.statusBar().showMessage(f"Search failed: {e}", 5000)
+            return
+        for row in rows:
+            item = QtWidgets.QListWidgetItem(f"{row['subject'] or '(no subject)'} \u2014 {row['sender']}  {row['date']}")
+            item.setData(QtCore.Qt.UserRole, row["path"])
+            self.search_results.addItem(item)
+        self.search_results.setVisible(bool(rows))
+        self.statusBar().showMessage(f"{len(rows)} matching emails", 5000)
+
+    def on_search_text_changed(self, text):
+        if not text:
+            self.search_results.clear()
+            self.search_results.hide()
+
+    def open_search_result(self, item):
+        self.load_email_file(item.data(QtCore.Qt.UserRole))
+
+    def get_folder_index(self, directory):
+        # `directory` is a folder, a Maildir or an mbox file (see
+        # message_source).
+        index = self.folder_indexes.get(path_key(directory))
+        if index is None:
+            index = open_index(directory)
+            self.add_folder_index(index)
+            self.folder_index_updated(index, True, opened=True)
         else:
-            content_type = msg.get_content_type()
-            content = msg.get_content()
-            if content_type == "text/html":
-                body = content
-            else:
-                body = "<pre>" + html.escape(content) + "</pre>"
-
-        self.body_text.setHtml(body)
-        self.body_text.document().setTextWidth(self.body_text.viewport().width())
-
-        # Process attachments.
-        for part in msg.walk():
-            content_disp = part.get("Content-Disposition", "")
-            if "attachment" in content_disp:
-                filename = part.get_filename()
-                if filename:
-                    data = part.get_payload(decode=True)
-                    temp_dir = tempfile.gettempdir()
-                    temp_path = os.path.join(temp_dir, filename)
-                    with open(temp_path, 'wb') as temp_file:
-                        temp_file.write(data)
-                    self.attachments[filename] = temp_path
-                    item = QtWidgets.QListWidgetItem(filename)
-                    icon = QtWidgets.QFileIconProvider().icon(QtCore.QFileInfo(temp_path))
-                    item.setIcon(icon)
-                    self.attachments_list.addItem(item)
+            self.folder_index_updated(index, index.refresh())
+        return index
 
-    def load_msg(self, file_path):
-        msg = extract_msg.Message(file_path)
-        msg_sender = msg.sender or ""
-        msg_to = msg.to or ""
-        msg_cc = msg.cc or ""
-        msg_bcc = msg.bcc or ""
-        msg_date = msg.date or ""
-        msg_subject = msg.subject or ""
-
-        self.label_from.setText(f"From: {msg_sender}")
-        self.label_to.setText(f"To: {msg_to}")
-        self.label_cc.setText(f"CC: {msg_cc}")
-        self.label_bcc.setText(f"BCC: {msg_bcc}")
-        self.label_subject.setText(f"Subject: {msg_subject}")
-        self.label_date.setText(f"Date: {msg_date}")
-
-        # For the body, prefer HTML if available.
-        if msg.htmlBody:
-            body = msg.htmlBody.decode("utf-8", errors="replace") if isinstance(msg.htmlBody, bytes) else msg.htmlBody
-        elif msg.body:
-            text = msg.body.decode("utf-8", errors="replace") if isinstance(msg.body, bytes) else msg.body
-            body = "<pre>" + html.escape(text) + "</pre>"
+    def add_folder_index(self, index):
+        self.folder_indexes[path_key(index.directory)] = index
+        for path in index.watch_paths():
+            self.watched_indexes[path_key(path)] = index
+            self.folder_watcher.addPath(path)
+
+    def folder_index_updated(self, index, changed, opened=False):
+        # Brings the metadata index, the message list and the date sort up
+        # to date with an index that was just opened or refreshed.
+        if changed and self.metadata_index is not None and index.bulk_scan:
+            self.metadata_index.scan(index.directory, index.files)
+        if changed or self.message_model.folder_index is not index:
+            self.message_model.set_folder(index)
+        # An index opened with its dates already known is sorted right away.
+        if (opened or changed and not index.dates_scanned) and self.sort_by_date_action.isChecked():
+            self.apply_date_sort()
+
+    def scan_folder_dates(self, folder_index):
+        if folder_index in self.date_scans:
+            return
+        self.date_scans.add(folder_index)
+        task = DateScanTask(folder_index, self.metadata_index)
+        task.signals.finished.connect(self.on_dates_scanned)
+        QtCore.QThreadPool.globalInstance().start(task)
+
+    def on_dates_scanned(self, folder_index, dates):
+        self.date_scans.discard(folder_index)
+        folder_index.dates.update(dates)
+        folder_index.dates_scanned = True
+        # Sort only if the date column is still the one chosen; the user may
+        # have picked another while the scan ran.
+        header = self.message_list.horizontalHeader()
+        if folder_index is self.message_model.folder_index and header.sortIndicatorSection() == 2:
+            self.message_model.sort_by_date(header.sortIndicatorOrder() == QtCore.Qt.DescendingOrder)
+
+    def apply_date_sort(self):
+        # Setting the sort indicator makes the view sort the model, unless it
+        # is already showing that indicator.
+        header = self.message_list.horizontalHeader()
+        if header.sortIndicatorSection() == 2 and header.sortIndicatorOrder() == QtCore.Qt.AscendingOrder:
+            self.message_model.sort_by_date()
         else:
-            body = ""
-        self.body_text.setHtml(body)
-        self.body_text.document().setTextWidth(self.body_text.viewport().width())
-
-        # Process attachments from the MSG file.
-        for att in msg.attachments:
-            filename = att.longFilename if att.longFilename else att.shortFilename
-            if filename:
-                temp_dir = tempfile.gettempdir()
-                temp_path = os.path.join(temp_dir, filename)
-                try:
-                    with open(temp_path, "wb") as f:
-                        f.write(att.data)
-                    self.attachments[filename] = temp_path
-                    item = QtWidgets.QListWidgetItem(filename)
-                    icon = QtWidgets.QFileIconProvider().icon(QtCore.QFileInfo(temp_path))
-                    item.setIcon(icon)
-                    self.attachments_list.addItem(item)
-                except Exception as e:
-                    print(f"Error saving attachment {filename}: {e}")
+            header.setSortIndicator(2, QtCore.Qt.AscendingOrder)
+
+    def on_sort_by_date_toggled(self, checked):
+        if self.folder_index is None:
+            return
+        if checked:
+            self.apply_date_sort()
+        elif self.message_list.horizontalHeader().sortIndicatorSection() != -1:
+            self.message_list.horizontalHeader().setSortIndicator(-1, QtCore.Qt.AscendingOrder)
+        else:
+            self.message_model.sort_by_name()
+
+    def select_list_row(self, row):
+        if row < 0:
+            self.message_list.clearSelection()
+            return
+        model_index = self.message_model.index(row, 0)
+        self.message_list.setCurrentIndex(model_index)
+        self.message_list.scrollTo(model_index)
+
+    def sync_list_selection(self):
+        if self.folder_index is not None and self.current_email_path:
+            self.current_index = self.folder_index.index_of(self.current_email_path)
+            self.select_list_row(self.current_index)
+
+    def open_list_row(self, model_index):
+        path = self.message_model.path(model_index.row())
+        if path_key(path) != path_key(self.current_email_path or ""):
+            self.load_email_file(path)
+
+    def on_directory_changed(self, directory):
+        index = self.watched_indexes.get(path_key(directory))
+        if index is not None:
+            index.dirty = True
+
+    def load_eml(self, file_path):
+        self.start_load(file_path, parse_eml)
+
+    def load_msg(self, file_path):
+        self.start_load(file_path, parse_pool.parse)
+
+    def show_message(self, file_path, message):
+        self.show_headers(message.headers)
+
+        body, truncated = preview_body(message.body)
+        if truncated:
+            remaining = format_size(len(message.body) - len(body))
+            body += f'<hr><p><a href="{SHOW_FULL_URL}">Show full message ({remaining} more)</a></p>'
+        self.full_body = message.body if truncated else None
+        timings = self.load_timings
+        with timings.span("render"):
+            self.body_text.set_message(file_path, message.resources)
+            self.body_text.show_html(body)
+
+        # List attachments by name only; nothing is decoded or written yet.
+        with timings.span("attachment list"):
+            self.attachments = list(message.attachments)
+            self.attachments_source = file_path
+            icon_provider = QtWidgets.QFileIconProvider()
+            for attachment in self.attachments:
+                item = QtWidgets.QListWidgetItem(attachment.filename)
+                item.setIcon(icon_provider.icon(QtCore.QFileInfo(attachment.filename)))
+                item.setToolTip(f"{attachment.content_type}, {format_size(attachment.size)}")
+                self.attachments_list.addItem(item)
+
+    def on_body_link_clicked(self, url):
+        if url.toString() == SHOW_FULL_URL:
+            self.show_full_body()
+        elif url.scheme() == "" and url.hasFragment():
+            self.body_text.scrollToAnchor(url.fragment())
+        elif url.scheme().lower() in EXTERNAL_LINK_SCHEMES and url.isValid():
+            QtGui.QDesktopServices.openUrl(url)
+
+    def show_full_body(self):
+        if self.full_body is None:
+            return
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            position = self.body_text.verticalScrollBar().value()
+            self.body_text.show_html(self.full_body)
+            self.body_text.verticalScrollBar().setValue(position)
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+        self.full_body = None
+
+    def show_headers(self, headers):
+        # Update header labels.
+        self.label_from.setText(f"From: {headers['From']}")
+        self.label_to.setText(f"To: {headers['To']}")
+        self.label_cc.setText(f"CC: {headers['Cc']}")
+        self.label_bcc.setText(f"BCC: {headers['Bcc']}")
+        self.label_subject.setText(f"Subject: {headers['Subject']}")
+        self.label_date.setText(f"Date: {headers['Date']}")
+
+    def extract_attachment_to(self, row, dest_path):
+        try:
+            with self.attachment_timings():
+                return extract_attachment(self.attachments_source, self.attachments[row], dest_path)
+        except Exception as e:
+            QtWidgets.QMessageBox.warning(self, "Error",
+                                          f"Could not extract attachment:\n{str(e)}")
+            return None
 
     def open_attachment(self, item):
-        filename = item.text()
-        if filename in self.attachments:
-            file_path = self.attachments[filename]
+        row = self.attachments_list.row(item)
+        if 0 <= row < len(self.attachments):
+            try:
+                with self.attachment_timings():
+                    file_path = self.attachment_cache.get(self.attachments_source, self.attachments[row])
+            except Exception as e:
+                QtWidgets.QMessageBox.warning(self, "Error",
+                                              f"Could not extract attachment:\n{str(e)}")
+                return
             try:
                 os.startfile(file_path)
             except Exception as e:
                 QtWidgets.QMessageBox.warning(self, "Error",
                                               f"Could not open attachment:\n{str(e)}")
 
+    def save_attachment(self, item):
+        row = self.attachments_list.row(item)
+        if 0 <= row < len(self.attachments):
+            dest_path, _ = QtWidgets.QFileDialog.getSaveFileName(
+                self, "Save Attachment", safe_filename(self.attachments[row].filename))
+            if dest_path:
+                self.extract_attachment_to(row, dest_path)
+
+    def save_all_attachments(self):
+        if not self.attachments:
+            return
+        directory = QtWidgets.QFileDialog.getExistingDirectory(self, "Save Attachments")
+        if directory:
+            names = unique_filenames(safe_filename(attachment.filename) for attachment in self.attachments)
+            targets = [(attachment, os.path.join(directory, name))
+                       for attachment, name in zip(self.attachments, names)]
+            try:
+                with self.attachment_timings():
+                    extract_attachments(self.attachments_source, targets)
+            except Exception as e:
+                QtWidgets.QMessageBox.warning(self, "Error",
+                                              f"Could not extract attachments:\n{str(e)}")
+
+    def show_attachment_menu(self, pos):
+        item = self.attachments_list.itemAt(pos)
+        if item is None:
+            return
+        menu = QtWidgets.QMenu(self)
+        menu.addAction("Open", lambda: self.open_attachment(item))
+        menu.addAction("Save As...", lambda: self.save_attachment(item))
+        menu.exec_(self.attachments_list.viewport().mapToGlobal(pos))
+
     def load_next(self):
-        if self.email_files_list:
-            next_index = (self.current_index + 1) % len(self.email_files_list)
-            self.load_email_file(self.email_files_list[next_index])
+        self.load_neighbour(1)
 
     def load_previous(self):
-        if self.email_files_list:
-            prev_index = (self.current_index - 1) % len(self.email_files_list)
-            self.load_email_file(self.email_files_list[prev_index])
+        self.load_neighbour(-1)
+
+    def load_neighbour(self, step):
+        if self.folder_index is None:
+            return
+        directory = self.folder_index.directory
+        if not self.prepare_source(directory, lambda: self.load_neighbour(step)):
+            return
+        # Through get_folder_index, so a change found by the refresh also
+        # updates the list and the metadata index.
+        self.folder_index = self.get_folder_index(directory)
+        path = self.folder_index.neighbour(self.current_email_path, step)
+        if path:
+            self.load_email_file(path)
 
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():
             for url in event.mimeData().urls():
                 file_path = url.toLocalFile()
-                if file_path.lower().endswith(('.eml', '.msg')):
+                if file_path.lower().endswith(email_extensions() + MBOX_EXTENSIONS + ARCHIVE_EXTENSIONS) or is_container(file_path):
                     event.acceptProposedAction()
                     return
         event.ignore()
@@ -278,19 +1194,46 @@ class EmailViewer(QtWidgets.QMainWindow):
         urls = event.mimeData().urls()
         if urls:
             file_path = urls[0].toLocalFile()
-            if file_path.lower().endswith(('.eml', '.msg')):
+            if message_kind(file_path) or is_container(file_path):
                 self.load_email_file(file_path)
 
-    def resizeEvent(self, event):
-        # Update the document's text width whenever the window is resized.
-        super().resizeEvent(event)
-        self.body_text.document().setTextWidth(self.body_text.viewport().width())
+    def closeEvent(self, event):
+        self.cancel_load()
+        self.prefetcher.shutdown()
+        self.message_model.shutdown()
+        if self.metadata_index is not None:
+            self.metadata_index.stop()
+        parse_pool.shutdown()
+        super().closeEvent(event)
+
+# Time from the start of main.py until the window is first shown that main() is
+# expected to stay under. Set EMLEE_STARTUP_TIME=1 to always print the time.
+STARTUP_BUDGET = 0.5
+
+
+def report_startup():
+    elapsed = time.perf_counter() - STARTED
+    if elapsed > STARTUP_BUDGET or os.environ.get("EMLEE_STARTUP_TIME"):
+        print(f"Startup took {elapsed * 1000:.0f} ms (budget {STARTUP_BUDGET * 1000:.0f} ms)")
+
 
 def main():
     app = QtWidgets.QApplication(sys.argv)
     viewer = EmailViewer()
     viewer.show()
+    # A file passed on the command line (e.g. opened from the file manager)
+    # is loaded once the window is up, so it shows as early as possible.
+    if len(sys.argv) > 1 and os.path.isfile(sys.argv[1]):
+        QtCore.QTimer.singleShot(0, lambda: viewer.load_email_file(sys.argv[1]))
+    QtCore.QTimer.singleShot(0, report_startup)
     sys.exit(app.exec_())
 
 if __name__ == "__main__":
+    # Needed for the process pools in the frozen Windows build.
+    if getattr(sys, "frozen", False):
+        import multiprocessing
+        multiprocessing.freeze_support()
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        import cli
+        sys.exit(cli.main(sys.argv[1:]))
     main()
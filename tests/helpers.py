@@ -0,0 +1,64 @@
+# Shared by the test modules: sample data and a test case with a scratch
+# directory. Importing it also makes emlee_core importable from tests/.
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import importlib.util
+from email import policy
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+OUTLOOK_SAMPLE = os.path.join(DATA, "outer.msg")
+
+
+def installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def sample_message(subject="Report", linesep="\n"):
+    # A message with most of the structure scan_mime has to follow: an
+    # alternative body, binary and text attachments, and a forwarded message
+    # that has an attachment of its own.
+    inner = EmailMessage()
+    inner["From"] = "Inner Sender <inner@example.com>"
+    inner["Subject"] = "Forwarded"
+    inner.set_content("The forwarded text.\n")
+    inner.add_attachment(b"inner attachment", maintype="application", subtype="octet-stream",
+                         filename="inner.bin")
+
+    message = EmailMessage()
+    message["From"] = "Sender <sender@example.com>"
+    message["To"] = "One <one@example.com>, two@example.com"
+    message["Cc"] = "cc@example.com"
+    message["Subject"] = subject
+    message["Date"] = "Tue, 01 Aug 2023 10:00:00 +0200"
+    message["Message-ID"] = "<report@example.com>"
+    message.set_content("Plain text with a line\nFrom the start of a line.\n")
+    message.add_alternative("<p>HTML <b>text</b> é</p>\n", subtype="html")
+    message.add_attachment(bytes(range(256)) * 50, maintype="application", subtype="octet-stream",
+                           filename="data.bin")
+    message.add_attachment("café = cost\n" * 20, subtype="plain", filename="notes.txt",
+                           cte="quoted-printable")
+    message.add_attachment(inner)
+    return message.as_bytes(policy=policy.default.clone(linesep=linesep))
+
+
+class TempDirTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="emlee-test-")
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
@@ -0,0 +1,84 @@
+# Tests for the ZIP and tar readers, checked against the zipfile, tarfile
+# and gzip modules.
+import io
+import os
+import gzip
+import random
+import tarfile
+import zipfile
+import unittest
+from unittest import mock
+
+from helpers import OUTLOOK_SAMPLE, TempDirTestCase, read_file, sample_message
+import emlee_core
+from emlee_core import (
+    ArchiveIndex, open_index, open_message, parse_email_file, path_key, read_date, split_locator,
+    stored_size,
+)
+
+
+class ArchiveTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        # Members with the contents expected of them, one of them too big
+        # to compress much so a compressed tar gets several checkpoints.
+        noise = random.Random(1).randbytes(64 * 1024)
+        self.members = {
+            "one.eml": sample_message("One"),
+            "folder/two.eml": sample_message("Two", linesep="\r\n"),
+            "noise.eml": b"Subject: Noise\n\n" + noise.hex().encode("ascii"),
+            "outer.msg": read_file(OUTLOOK_SAMPLE),
+        }
+
+    def check_archive(self, path):
+        index = open_index(path)
+        self.assertIsInstance(index, ArchiveIndex)
+        self.assertEqual(sorted(split_locator(locator)[1] for locator in index.files), sorted(self.members))
+        for locator in index.files:
+            name = split_locator(locator)[1]
+            with self.subTest(name):
+                with open_message(locator) as (buf, start, end):
+                    self.assertEqual(bytes(buf[start:end]), self.members[name])
+                self.assertEqual(stored_size(locator), len(self.members[name]))
+                original = self.write("original" + os.path.splitext(name)[1], self.members[name])
+                self.assertEqual(parse_email_file(locator).headers, parse_email_file(original).headers)
+
+    def test_zip(self):
+        path = os.path.join(self.directory, "test.zip")
+        methods = [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2, zipfile.ZIP_DEFLATED]
+        with zipfile.ZipFile(path, "w") as archive:
+            for (name, data), method in zip(self.members.items(), methods):
+                archive.writestr(name, data, compress_type=method)
+            archive.writestr("readme.txt", b"not an email")
+        self.check_archive(path)
+
+    def test_tar(self):
+        for mode, name in (("w", "test.tar"), ("w:gz", "test.tar.gz")):
+            with self.subTest(name):
+                path = os.path.join(self.directory, name)
+                with tarfile.open(path, mode) as archive:
+                    for member, data in self.members.items():
+                        info = tarfile.TarInfo(member)
+                        info.size = len(data)
+                        archive.addfile(info, io.BytesIO(data))
+                with mock.patch.object(emlee_core, "GZIP_CHECKPOINT_INTERVAL", 16 * 1024):
+                    self.check_archive(path)
+                    catalogue = emlee_core.archive_catalogue(path)
+                    if name.endswith(".gz"):
+                        self.assertGreater(len(catalogue.checkpoints), 2)
+                        # The dates come with the catalogue, as read_date
+                        # would have read them.
+                        index = open_index(path)
+                        self.assertTrue(index.dates_scanned)
+                        for locator in index.files:
+                            self.assertEqual(index.dates[path_key(locator)], read_date(locator))
+
+    def test_gzip_stream(self):
+        # Several gzip members back to back read as one stream, as gzip does.
+        data = gzip.compress(self.members["noise.eml"]) + gzip.compress(self.members["one.eml"])
+        stream = emlee_core.GzipStream(data)
+        self.assertEqual(stream.read(), gzip.decompress(data))
+
+
+if __name__ == "__main__":
+    unittest.main()
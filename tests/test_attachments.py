@@ -0,0 +1,74 @@
+# Tests for saving attachments: file names and decoding.
+import os
+import base64
+import quopri
+import random
+import binascii
+import unittest
+
+from helpers import TempDirTestCase, read_file
+from emlee_core import decode_to_file, iter_decoded, safe_filename, unique_filenames
+
+
+class FilenameTest(TempDirTestCase):
+    def test_unique_filenames(self):
+        names = ["a.txt", "A.TXT", "a (2).txt", "a.txt", "noext", "noext", "../noext"]
+        unique = unique_filenames([safe_filename(name) for name in names])
+        self.assertEqual(unique, ["a.txt", "A (2).TXT", "a (2) (2).txt", "a (3).txt",
+                                  "noext", "noext (2)", "noext (3)"])
+        # Saved side by side, none of them overwrites another, also where
+        # file names are not case sensitive.
+        for number, name in enumerate(unique):
+            self.write(name, str(number).encode("ascii"))
+        self.assertEqual(len({name.lower() for name in os.listdir(self.directory)}), len(names))
+
+    def test_safe_filename(self):
+        self.assertEqual(safe_filename("..\\..\\evil.exe"), "evil.exe")
+        self.assertEqual(safe_filename("/etc/passwd"), "passwd")
+        self.assertEqual(safe_filename('what?<>:"|*.txt'), "what_______.txt")
+        self.assertEqual(safe_filename(" .. "), "attachment")
+
+
+class DecodeTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        generator = random.Random(6)
+        self.data = generator.randbytes(3000) + "café\n".encode("utf-8") * 100
+        self.encoded = {
+            "base64": base64.encodebytes(self.data),
+            "quoted-printable": quopri.encodestring(self.data),
+            "8bit": self.data,
+        }
+        # base64 as one long line, and with CRLF line breaks.
+        self.encoded["base64 "] = base64.b64encode(self.data)
+        self.encoded["BASE64"] = self.encoded["base64"].replace(b"\n", b"\r\n")
+        self.encoded["Quoted-Printable"] = self.encoded["quoted-printable"].replace(b"\n", b"\r\n")
+
+    def test_chunk_boundaries(self):
+        # Whatever the chunk size, the chunks decode to the same bytes as the
+        # payload in one go, including a payload inside a larger buffer.
+        for cte, encoded in self.encoded.items():
+            if cte.lower() == "quoted-printable":
+                expected = binascii.a2b_qp(encoded)
+            else:
+                expected = self.data
+            buf = b"--before--\n" + encoded + b"\n--after--"
+            start, end = 11, 11 + len(encoded)
+            for chunk_size in (1, 2, 3, 5, 7, 64, 75, 76, 77, 78, 1000, len(encoded)):
+                with self.subTest(cte=cte, chunk_size=chunk_size):
+                    decoded = b"".join(iter_decoded(buf, cte, start, end, chunk_size))
+                    self.assertEqual(decoded, expected)
+
+    def test_truncated_base64(self):
+        # Like get_payload, decode what is there.
+        encoded = base64.b64encode(b"truncated payload")[:-2]
+        self.assertEqual(b"".join(iter_decoded(encoded, "base64", chunk_size=4)), b"truncated payloa")
+
+    def test_decode_to_file(self):
+        path = os.path.join(self.directory, "decoded")
+        decode_to_file(self.encoded["base64"], "base64", path, chunk_size=100)
+        self.assertEqual(read_file(path), self.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+# Tests for the caches of parsed messages and extracted attachments.
+import os
+import unittest
+
+from helpers import TempDirTestCase, read_file, sample_message
+from emlee_core import (
+    AttachmentCache, MessageCache, ParsedMessage, file_signature, message_size, parse_email_file,
+)
+
+
+def message(body_size):
+    return ParsedMessage({"Subject": "Cached"}, "x" * body_size, [])
+
+
+class MessageCacheTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.size = message_size(message(10000))
+        # Room for four messages of that size, each under a quarter of it.
+        self.cache = MessageCache(self.size * 4 + self.size // 2)
+        self.signatures = [file_signature(self.write(f"{number}.eml", b"Subject: Cached\n\n"))
+                           for number in range(5)]
+
+    def test_evicts_least_recently_used(self):
+        messages = [message(10000) for _ in self.signatures]
+        for signature, cached in zip(self.signatures[:4], messages):
+            self.cache.put(signature, cached)
+        self.assertEqual(self.cache.total_bytes, self.size * 4)
+        # Using the first makes the second the least recently used.
+        self.assertIs(self.cache.get(self.signatures[0]), messages[0])
+        self.cache.put(self.signatures[4], messages[4])
+        self.assertNotIn(self.signatures[1], self.cache)
+        self.assertIsNone(self.cache.get(self.signatures[1]))
+        for position in (0, 2, 3, 4):
+            self.assertIs(self.cache.get(self.signatures[position]), messages[position])
+        self.assertEqual(self.cache.total_bytes, self.size * 4)
+
+    def test_changed_file(self):
+        # A file that changed has a new signature, so its old entry is not
+        # found.
+        path = os.path.join(self.directory, "0.eml")
+        self.cache.put(file_signature(path), message(10000))
+        with open(path, "ab") as f:
+            f.write(b"More text\n")
+        self.assertIsNone(self.cache.get(file_signature(path)))
+
+    def test_replace(self):
+        signature = self.signatures[0]
+        self.cache.put(signature, message(10000))
+        replacement = message(10500)
+        self.cache.put(signature, replacement)
+        self.assertIs(self.cache.get(signature), replacement)
+        self.assertEqual(self.cache.total_bytes, message_size(replacement))
+
+    def test_large_messages_are_not_cached(self):
+        # Over a quarter of the budget; it also drops an older version.
+        signature = self.signatures[0]
+        self.cache.put(signature, message(10000))
+        self.cache.put(signature, message(self.size * 2))
+        self.assertNotIn(signature, self.cache)
+        self.assertEqual(self.cache.total_bytes, 0)
+        self.cache.put(None, message(10000))
+        self.assertEqual(self.cache.total_bytes, 0)
+
+    def test_clear(self):
+        self.cache.put(self.signatures[0], message(10000))
+        self.cache.clear()
+        self.assertNotIn(self.signatures[0], self.cache)
+        self.assertEqual(self.cache.total_bytes, 0)
+
+
+class AttachmentCacheTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = AttachmentCache(os.path.join(self.directory, "cache"), max_bytes=2500)
+
+    def add_entry(self, name, mtime):
+        directory = os.path.join(self.cache.root, name)
+        os.makedirs(directory)
+        with open(os.path.join(directory, "attachment.bin"), "wb") as f:
+            f.write(b"x" * 1000)
+        os.utime(directory, (mtime, mtime))
+        return directory
+
+    def entries(self):
+        return sorted(os.listdir(self.cache.root))
+
+    def test_trim_removes_least_recently_used(self):
+        for number, name in enumerate("abcd"):
+            self.add_entry(name, 1000000 + number)
+        self.cache.trim()
+        self.assertEqual(self.entries(), ["c", "d"])
+        # Under the budget nothing goes.
+        self.cache.trim()
+        self.assertEqual(self.entries(), ["c", "d"])
+
+    def test_trim_keeps_entry_in_use(self):
+        entries = [self.add_entry(name, 1000000 + number) for number, name in enumerate("abcd")]
+        self.cache.trim(keep=entries[0])
+        self.assertEqual(self.entries(), ["a", "d"])
+
+    def test_trim_without_cache_directory(self):
+        self.cache.trim()
+        self.assertFalse(os.path.exists(self.cache.root))
+
+    def test_get(self):
+        path = self.write("sample.eml", sample_message())
+        attachments = parse_email_file(path).attachments
+        extracted = self.cache.get(path, attachments[0])
+        self.assertEqual(os.path.basename(extracted), "data.bin")
+        self.assertEqual(read_file(extracted), bytes(range(256)) * 50)
+        # Over the budget on its own, the attachment just extracted stays;
+        # the older one goes.
+        self.assertEqual(self.cache.get(path, attachments[0]), extracted)
+        other = self.cache.get(path, attachments[1])
+        self.assertTrue(os.path.isfile(other))
+        self.assertFalse(os.path.exists(extracted))
+
+
+if __name__ == "__main__":
+    unittest.main()
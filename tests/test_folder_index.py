@@ -0,0 +1,68 @@
+# Tests for FolderIndex: the incremental refresh and stepping through a
+# folder whose files change.
+import os
+import unittest
+
+from helpers import TempDirTestCase
+from emlee_core import FolderIndex
+
+
+class FolderIndexTest(TempDirTestCase):
+    def names(self, index):
+        return [os.path.basename(path) for path in index.files]
+
+    def add(self, *names):
+        for name in names:
+            self.write(name, f"Subject: {name}\n\nBody\n".encode("ascii"))
+
+    def remove(self, *names):
+        for name in names:
+            os.remove(os.path.join(self.directory, name))
+
+    def refresh(self, index):
+        # The directory's mtime may not change within its resolution.
+        index.dirty = True
+        return index.refresh()
+
+    def test_refresh(self):
+        self.add("b.eml", "d.eml", "f.eml", "notes.txt")
+        index = FolderIndex(self.directory, (".eml",))
+        self.assertEqual(self.names(index), ["b.eml", "d.eml", "f.eml"])
+        self.assertFalse(self.refresh(index))
+
+        # Added files are merged into the current order.
+        index.sort_by(lambda path: os.path.basename(path) in ("a.eml", "f.eml"), reverse=True)
+        self.assertEqual(self.names(index), ["f.eml", "d.eml", "b.eml"])
+        self.remove("d.eml")
+        self.add("a.eml", "e.eml")
+        self.assertTrue(self.refresh(index))
+        self.assertEqual(self.names(index), ["f.eml", "a.eml", "e.eml", "b.eml"])
+        for position, path in enumerate(index.files):
+            self.assertEqual(index.index_of(path), position)
+        self.assertEqual(index.index_of(os.path.join(self.directory, "d.eml")), -1)
+
+    def test_neighbour(self):
+        self.add("b.eml", "d.eml", "f.eml")
+        index = FolderIndex(self.directory, (".eml",))
+        path = os.path.join(self.directory, "d.eml")
+        self.assertEqual(os.path.basename(index.neighbour(path, 1)), "f.eml")
+        self.assertEqual(os.path.basename(index.neighbour(path, 2)), "b.eml")
+
+        # Stepping from a file that is gone goes to the files that are now
+        # around the place it had.
+        self.remove("d.eml")
+        self.add("a.eml", "e.eml")
+        self.refresh(index)
+        self.assertEqual(os.path.basename(index.neighbour(path, 1)), "e.eml")
+        self.assertEqual(os.path.basename(index.neighbour(path, -1)), "b.eml")
+        index.sort_by(None, reverse=True)
+        self.assertEqual(os.path.basename(index.neighbour(path, 1)), "b.eml")
+        self.assertEqual(os.path.basename(index.neighbour(path, -1)), "e.eml")
+
+        # Past either end, it wraps around.
+        self.assertEqual(os.path.basename(index.neighbour(os.path.join(self.directory, "g.eml"), 1)), "f.eml")
+        self.assertEqual(os.path.basename(index.neighbour(os.path.join(self.directory, "g.eml"), -1)), "a.eml")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+# Tests for the mbox and Maildir indexes, checked against the mailbox
+# module.
+import os
+import mailbox
+import unittest
+from email import policy
+from email.parser import BytesParser
+
+from helpers import TempDirTestCase, sample_message
+from emlee_core import MaildirIndex, MboxIndex, open_index, open_message, parse_email_file, stored_size
+
+
+class MboxTest(TempDirTestCase):
+    def test_messages_match_mailbox(self):
+        path = os.path.join(self.directory, "test.mbox")
+        box = mailbox.mbox(path)
+        subjects = [f"Message {number}" for number in range(5)]
+        for subject in subjects:
+            box.add(sample_message(subject))
+        box.flush()
+
+        index = open_index(path)
+        self.assertIsInstance(index, MboxIndex)
+        self.assertEqual(len(index), len(subjects))
+        for position, key in enumerate(box.keys()):
+            locator = index.files[position]
+            message = parse_email_file(locator)
+            self.assertEqual(message.headers["Subject"], subjects[position])
+            # The "From " line inside the body was escaped by mailbox and
+            # must not start a new message.
+            self.assertEqual(len(message.attachments), 3)
+            with open_message(locator) as (buf, start, end):
+                self.assertEqual(stored_size(locator), end - start)
+                self.assertEqual(BytesParser(policy=policy.default).parsebytes(bytes(buf[start:end]))["Subject"],
+                                 box.get_message(key)["Subject"])
+
+        # Appending only scans the new part. The rescan leaves the index as
+        # it is until its result is applied.
+        box.add(sample_message("Appended"))
+        box.flush()
+        box.close()
+        self.assertTrue(index.stale())
+        scan = index.rescan()
+        self.assertEqual(len(index), len(subjects))
+        self.assertTrue(index.update(scan))
+        self.assertFalse(index.stale())
+        self.assertFalse(index.refresh())
+        self.assertEqual(len(index), len(subjects) + 1)
+        self.assertEqual(parse_email_file(index.files[len(subjects)]).headers["Subject"], "Appended")
+
+
+class MaildirTest(TempDirTestCase):
+    def test_messages_match_mailbox(self):
+        path = os.path.join(self.directory, "Maildir")
+        box = mailbox.Maildir(path, create=True)
+        subjects = {f"Message {number}" for number in range(4)}
+        for subject in subjects:
+            box.add(sample_message(subject))
+        index = open_index(path)
+        self.assertIsInstance(index, MaildirIndex)
+        self.assertEqual({parse_email_file(file).headers["Subject"] for file in index.files}, subjects)
+
+
+if __name__ == "__main__":
+    unittest.main()
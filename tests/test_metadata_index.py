@@ -0,0 +1,107 @@
+# Tests for the on-disk metadata index and its full-text search.
+import os
+import sqlite3
+import threading
+import unittest
+
+from helpers import TempDirTestCase, sample_message
+from emlee_core import MetadataIndex, path_key
+
+
+class MetadataIndexTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = os.path.join(self.directory, "mail")
+        os.mkdir(self.folder)
+        self.index = MetadataIndex(os.path.join(self.directory, "cache", "index.sqlite3"))
+        self.addCleanup(self.index.close)
+
+    def add(self, name, subject):
+        path = os.path.join(self.folder, name)
+        with open(path, "wb") as f:
+            f.write(sample_message(subject))
+        return path
+
+    def scan(self, paths):
+        # What MetadataIndex.scan runs on its thread.
+        self.index._scan(self.folder, paths, threading.Event())
+
+    def test_rows_follow_the_files(self):
+        paths = [self.add(f"{number}.eml", f"Message {number}") for number in range(3)]
+        self.scan(paths)
+        row = self.index.lookup(paths[0])
+        self.assertEqual(row["subject"], "Message 0")
+        self.assertEqual(row["sender"], "Sender <sender@example.com>")
+        self.assertEqual(row["attachments"], "data.bin\nnotes.txt\ninner.bin")
+        self.assertEqual(row["message_size"], os.path.getsize(paths[0]))
+        self.assertEqual(set(self.index.directory_dates(self.folder)), {path_key(path) for path in paths})
+
+        # A file that changed has a stale row until the next scan.
+        self.add("0.eml", "Changed")
+        self.assertIsNone(self.index.lookup(paths[0]))
+        self.assertIn(path_key(paths[0]), self.index.directory_rows(self.folder))
+        self.scan(paths)
+        self.assertEqual(self.index.lookup(paths[0])["subject"], "Changed")
+
+        # Rows of files that are gone are dropped.
+        os.remove(paths[1])
+        self.scan([paths[0], paths[2]])
+        self.assertIsNone(self.index.lookup(paths[1]))
+        self.assertEqual(set(self.index.directory_rows(self.folder)), {path_key(paths[0]), path_key(paths[2])})
+
+    def test_survives_reopening(self):
+        path = self.add("0.eml", "Kept")
+        self.scan([path])
+        self.index.close()
+        reopened = MetadataIndex(self.index.db_path)
+        self.addCleanup(reopened.close)
+        self.assertEqual(reopened.lookup(path)["subject"], "Kept")
+
+    def search(self, text, directory=None):
+        if not self.index.fts:
+            self.skipTest("SQLite has no FTS5 support")
+        return sorted(os.path.basename(row["path"]) for row in self.index.search(text, directory or self.folder))
+
+    def test_search(self):
+        paths = [self.add(f"{number}.eml", f"Message {number}") for number in range(3)]
+        self.scan(paths)
+        self.assertEqual(self.search("message 1"), ["1.eml"])
+        self.assertEqual(self.search("mess"), ["0.eml", "1.eml", "2.eml"])
+        # The body text is indexed as well, but not the attachments.
+        self.assertEqual(self.search("html text"), ["0.eml", "1.eml", "2.eml"])
+        self.assertEqual(self.search("forwarded"), [])
+        self.assertEqual(self.search("message", self.directory), [])
+
+        # Replaced and removed messages leave no text behind.
+        self.add("0.eml", "Renamed")
+        os.remove(paths[1])
+        self.scan([paths[0], paths[2]])
+        self.assertEqual(self.search("renamed"), ["0.eml"])
+        self.assertEqual(self.search("message"), ["2.eml"])
+        conn = self.index.connect()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM message_text").fetchone()[0], 2)
+
+    def test_rebuilds_older_schema(self):
+        # An index from before messages had an id column and message sizes.
+        self.index.close()
+        db_path = os.path.join(self.directory, "old.sqlite3")
+        conn = sqlite3.connect(db_path)
+        with conn:
+            conn.execute("CREATE TABLE messages (key TEXT PRIMARY KEY, path TEXT, directory TEXT, "
+                         "size INTEGER, mtime INTEGER, subject TEXT)")
+            conn.execute("INSERT INTO messages VALUES ('key', 'path', 'directory', 1, 1, 'Old')")
+        conn.close()
+
+        self.index = MetadataIndex(db_path)
+        self.addCleanup(self.index.close)
+        conn = self.index.connect()
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(messages)")}
+        self.assertLessEqual({"id", "message_size", "date_ts"}, columns)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0], 0)
+        path = self.add("0.eml", "New")
+        self.scan([path])
+        self.assertEqual(self.index.lookup(path)["subject"], "New")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+# Tests for the MIME reader, checked against the email package.
+import os
+import glob
+import unittest
+import importlib.util
+from email import policy
+from email.parser import BytesParser
+
+from helpers import TempDirTestCase, installed, read_file, sample_message
+from emlee_core import extract_attachment, html_to_text, parse_email_file, read_eml_headers, scan_mime
+
+
+def digest_message():
+    # Parts of a multipart/digest without a Content-Type are messages.
+    parts = []
+    for number in (1, 2):
+        parts.append(f"\nFrom: member{number}@example.com\nSubject: Member {number}\n\nBody {number}\n")
+    body = "".join(f"--DIGEST\n{part}\n" for part in parts)
+    return ("From: list@example.com\nSubject: Digest\nMIME-Version: 1.0\n"
+            "Content-Type: multipart/digest; boundary=DIGEST\n\n"
+            f"{body}--DIGEST--\n").encode("ascii")
+
+
+class MimeTest(TempDirTestCase):
+    def assert_same_parts(self, data):
+        # scan_mime must list the parts in the order and with the types of
+        # EmailMessage.walk(), as attachment indexes refer to that order.
+        walked = [part.get_content_type()
+                  for part in BytesParser(policy=policy.default).parsebytes(data).walk()]
+        self.assertEqual([part.headers.get_content_type() for part in scan_mime(data)], walked)
+
+    def test_parts_match_walk(self):
+        for linesep in ("\n", "\r\n"):
+            with self.subTest(linesep=repr(linesep)):
+                self.assert_same_parts(sample_message(linesep=linesep))
+
+    def test_digest_parts_are_messages(self):
+        data = digest_message()
+        self.assert_same_parts(data)
+        self.assertEqual([part.headers.get_content_type() for part in scan_mime(data)],
+                         ["multipart/digest", "message/rfc822", "text/plain",
+                          "message/rfc822", "text/plain"])
+
+    def test_boundary_prefix(self):
+        # The inner boundary starts with the outer one followed by "--",
+        # which makes its delimiter lines look like the outer close
+        # delimiter.
+        data = (b"From: sender@example.com\nSubject: Nested\nMIME-Version: 1.0\n"
+                b'Content-Type: multipart/mixed; boundary="abc"\n\n'
+                b"--abc\nContent-Type: text/plain\n\nFirst\n"
+                b'--abc\nContent-Type: multipart/alternative; boundary="abc--x"\n\n'
+                b"--abc--x\nContent-Type: text/plain\n\nText\n"
+                b"--abc--x\nContent-Type: text/html\n\n<p>HTML</p>\n"
+                b"--abc--x--\n"
+                b"--abc--\n")
+        self.assert_same_parts(data)
+        self.assertEqual(len(scan_mime(data)), 5)
+
+    @unittest.skipUnless(installed("test.test_email"), "CPython's email tests are not installed")
+    def test_cpython_email_corpus(self):
+        spec = importlib.util.find_spec("test.test_email")
+        corpus = os.path.join(os.path.dirname(spec.origin), "data")
+        paths = sorted(glob.glob(os.path.join(corpus, "msg_*.txt")))
+        self.assertTrue(paths)
+        for path in paths:
+            with self.subTest(os.path.basename(path)):
+                self.assert_same_parts(read_file(path))
+
+    def test_parse_eml(self):
+        for linesep in ("\n", "\r\n"):
+            with self.subTest(linesep=repr(linesep)):
+                data = sample_message(linesep=linesep)
+                path = self.write("sample.eml", data)
+                expected = BytesParser(policy=policy.default).parsebytes(data)
+                message = parse_email_file(path)
+                for name in ("From", "To", "Cc", "Subject", "Date", "Message-ID"):
+                    self.assertEqual(message.headers[name], str(expected[name]))
+                self.assertEqual(read_eml_headers(path), message.headers)
+                self.assertEqual(html_to_text(message.body).strip(), "HTML text é")
+
+                # Every attachment, including the one inside the forwarded
+                # message, decodes to what the email package makes of it.
+                parts = list(expected.walk())
+                self.assertEqual([attachment.filename for attachment in message.attachments],
+                                 ["data.bin", "notes.txt", "inner.bin"])
+                for attachment in message.attachments:
+                    target = os.path.join(self.directory, "out")
+                    extract_attachment(path, attachment, target)
+                    self.assertEqual(read_file(target), parts[attachment.index].get_payload(decode=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+# Regression tests for the .msg reader in emlee_core, checked against
+# olefile, compressed_rtf and extract_msg on a message saved by Outlook
+# (data/outer.msg).
+#
+#   python -m unittest discover tests
+import unittest
+
+from helpers import OUTLOOK_SAMPLE, installed, read_file
+from emlee_core import CompoundFile, html_to_text, lzfu_decompress, parse_email_file, rtf_to_html
+
+
+class OutlookTest(unittest.TestCase):
+    def setUp(self):
+        self.data = read_file(OUTLOOK_SAMPLE)
+
+    @unittest.skipUnless(installed("olefile"), "olefile is not installed")
+    def test_compound_file_streams(self):
+        import olefile
+        cf = CompoundFile(self.data)
+
+        def streams(storage, prefix):
+            for name, index in cf.children(storage).items():
+                entry_type = cf.entries[index][1]
+                if entry_type == 1:
+                    yield from streams(index, prefix + (name,))
+                elif entry_type == 2:
+                    yield prefix + (name,), cf.read_stream(index)
+
+        with olefile.OleFileIO(self.data) as ole:
+            expected = {tuple(name.upper() for name in path): ole.openstream(path).read()
+                        for path in ole.listdir(streams=True, storages=False)}
+        self.assertEqual(dict(streams(0, ())), expected)
+
+    @unittest.skipUnless(installed("compressed_rtf"), "compressed_rtf is not installed")
+    def test_compressed_rtf(self):
+        import compressed_rtf
+        cf = CompoundFile(self.data)
+        rtf = cf.read_stream(cf.children(0)["__SUBSTG1.0_10090102"])
+        decompressed = lzfu_decompress(rtf)
+        self.assertEqual(decompressed, compressed_rtf.decompress(rtf))
+        self.assertEqual(html_to_text(rtf_to_html(decompressed)).strip(), "Outer body")
+
+        text = b"{\\rtf1\\ansi\\deff0 {\\fonttbl {\\f0 Arial;}} Some text, some text, some text.\\par}"
+        self.assertEqual(lzfu_decompress(compressed_rtf.compress(text, compressed=True)), text)
+        self.assertEqual(lzfu_decompress(compressed_rtf.compress(text, compressed=False)), text)
+
+    @unittest.skipUnless(installed("extract_msg"), "extract_msg is not installed")
+    def test_matches_extract_msg(self):
+        import extract_msg
+        message = parse_email_file(OUTLOOK_SAMPLE)
+        reference = extract_msg.Message(OUTLOOK_SAMPLE)
+        try:
+            self.assertEqual(message.headers["Subject"], reference.subject)
+            self.assertIn("outer@foo.bar", reference.to)
+            self.assertIn("outer@foo.bar", message.headers["To"])
+            self.assertEqual(html_to_text(message.body).strip(), reference.body.strip())
+            # Only attachments stored by value, with a name, are listed.
+            named = [attachment.longFilename or attachment.shortFilename
+                     for attachment in reference.attachments if isinstance(attachment.data, bytes)]
+            self.assertEqual([attachment.filename for attachment in message.attachments],
+                             [name for name in named if name])
+        finally:
+            reference.close()
+
+
+if __name__ == "__main__":
+    unittest.main()